@@ -0,0 +1,221 @@
+#! python3
+'''
+Times gallop's hot paths on synthetic data (see synthetic.py) and reports throughput and peak memory.
+
+    python benchmarks/bench_gallop.py --sizes 1000 10000 100000 --save baseline.json
+    python benchmarks/bench_gallop.py --sizes 1000 10000 100000 --baseline baseline.json
+
+Sizes are numbers of past performances (or starters, for the chart based benchmarks). With --baseline, any
+benchmark that got more than --threshold slower is flagged and the exit status is 1.
+'''
+
+
+from argparse import ArgumentParser
+from collections.abc import Callable
+from contextlib import contextmanager, redirect_stdout
+from datetime import date
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pandas import DataFrame  # noqa: E402
+
+import synthetic  # noqa: E402
+from gallop import speed, utility, variants  # noqa: E402
+from gallop.pacecontainer import PaceContainer, PaceContainerPastPerformance, pace_figures_from_dataframe  # noqa: E402
+
+
+DEFAULT_SIZES: list[int] = [1000, 10000, 100000]
+DEFAULT_REPEAT: int = 3
+DEFAULT_THRESHOLD: float = 0.2
+REFERENCE_DATE: date = date(2025, 1, 1)
+
+
+Benchmark = Callable[[int], tuple[Callable[[], object], int]]
+
+
+@contextmanager
+def synthetic_variants():
+    '''
+    Swaps the variant cache's horsedb2 backend for the local stub.
+    '''
+    cache = variants.DEFAULT_VARIANT_CACHE
+    variants.DEFAULT_VARIANT_CACHE = variants.VariantCache(backend=synthetic.get_average_variant)
+    try:
+        yield
+    finally:
+        variants.DEFAULT_VARIANT_CACHE = cache
+
+
+@contextmanager
+def synthetic_files(charts: list[synthetic.SyntheticChart], singlefiles: list[synthetic.SyntheticSingleFile]):
+    '''
+    Points get_all_pace_data's file handling at in-memory synthetic charts and SingleFiles, so the rest of
+    the pipeline runs unchanged.
+    '''
+    chart_paths = {f'{synthetic.SYNTHETIC_TRACK_CODE}{chart.header.race_date.strftime('%Y%m%d')}.chart': chart
+                   for chart in charts}
+    pp_paths = {utility.get_pp_path(synthetic.SYNTHETIC_TRACK_CODE, chart.header.race_date): singlefile
+                for chart, singlefile in zip(charts, singlefiles)}
+
+    class SyntheticSingleFileFactory:
+        @staticmethod
+        def create(path: str) -> synthetic.SyntheticSingleFile:
+            return pp_paths[path]
+
+    # gallop imports parse_chart and SingleFile when it uses them, so those are patched at their source
+    import brispy.singlefile
+    import chart_parser.utils
+    patched = [
+        (utility, 'get_chart_paths', lambda path, track_code, catalog=None: sorted(chart_paths)),
+        (utility, 'check_if_pp_exists', lambda track_code, race_date, catalog=None: True),
+        (chart_parser.utils, 'parse_chart', chart_paths.__getitem__),
+        (brispy.singlefile, 'SingleFile', SyntheticSingleFileFactory),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patched]
+    for module, name, value in patched:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+
+def get_past_performances(singlefiles: list[synthetic.SyntheticSingleFile]) -> list:
+    return [pp for singlefile in singlefiles for row in singlefile.rows for pp in row.horse.past_performances]
+
+
+def bench_pace_container_past_performance(size: int) -> tuple[Callable[[], object], int]:
+    pps = get_past_performances(synthetic.create_singlefiles(size))
+    return lambda: [PaceContainerPastPerformance(pp) for pp in pps], len(pps)
+
+
+def bench_pace_container(size: int) -> tuple[Callable[[], object], int]:
+    singlefiles = synthetic.create_singlefiles(size)
+    horses = [row.horse for singlefile in singlefiles for row in singlefile.rows]
+    count = sum(len(horse.past_performances) for horse in horses)
+    return lambda: [PaceContainer(horse, reference_date=REFERENCE_DATE) for horse in horses], count
+
+
+def bench_pace_figures_from_dataframe(size: int) -> tuple[Callable[[], object], int]:
+    pps = get_past_performances(synthetic.create_singlefiles(size))
+    sfpp_df = DataFrame([vars(pp) for pp in pps])
+    return lambda: pace_figures_from_dataframe(sfpp_df), len(pps)
+
+
+def bench_singlefile_to_combined_dataframe(size: int) -> tuple[Callable[[], object], int]:
+    singlefiles = synthetic.create_singlefiles(size)
+    count = len(get_past_performances(singlefiles))
+    return lambda: [utility.singlefile_to_combined_dataframe(singlefile) for singlefile in singlefiles], count
+
+
+def bench_get_speed_table(size: int) -> tuple[Callable[[], object], int]:
+    charts = synthetic.create_charts(max(1, size // (synthetic.RACES_PER_DAY * synthetic.HORSES_PER_RACE)))
+    races = [(race, chart.header.race_date.strftime('%Y%m%d')) for chart in charts for race in chart.races]
+    return lambda: [speed.get_speed_table(race, race_date) for race, race_date in races], \
+        len(races) * synthetic.HORSES_PER_RACE
+
+
+def bench_get_season_speed_table(size: int) -> tuple[Callable[[], object], int]:
+    charts = synthetic.create_charts(max(1, size // (synthetic.RACES_PER_DAY * synthetic.HORSES_PER_RACE)))
+    return lambda: speed.get_season_speed_table(charts), \
+        len(charts) * synthetic.RACES_PER_DAY * synthetic.HORSES_PER_RACE
+
+
+def bench_summarize_post_positions(size: int) -> tuple[Callable[[], object], int]:
+    charts = synthetic.create_charts(max(1, size // (synthetic.RACES_PER_DAY * synthetic.HORSES_PER_RACE)))
+    return lambda: utility.summarize_post_positions(charts), \
+        len(charts) * synthetic.RACES_PER_DAY * synthetic.HORSES_PER_RACE
+
+
+def bench_get_all_pace_data(size: int) -> tuple[Callable[[], object], int]:
+    singlefiles = synthetic.create_singlefiles(size)
+    charts = synthetic.create_charts(len(singlefiles))
+
+    def run() -> object:
+        with synthetic_files(charts, singlefiles):
+            return utility.get_all_pace_data('', synthetic.SYNTHETIC_TRACK_CODE)
+
+    return run, len(get_past_performances(singlefiles))
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    'PaceContainerPastPerformance': bench_pace_container_past_performance,
+    'PaceContainer': bench_pace_container,
+    'pace_figures_from_dataframe': bench_pace_figures_from_dataframe,
+    'singlefile_to_combined_dataframe': bench_singlefile_to_combined_dataframe,
+    'speed.get_speed_table': bench_get_speed_table,
+    'speed.get_season_speed_table': bench_get_season_speed_table,
+    'summarize_post_positions': bench_summarize_post_positions,
+    'get_all_pace_data': bench_get_all_pace_data,
+}
+
+
+def run_benchmark(benchmark: Benchmark, size: int, repeat: int) -> dict[str, float]:
+    with synthetic_variants(), redirect_stdout(io.StringIO()):
+        run, units = benchmark(size)
+        run()   # warm up, fills the variant cache
+        seconds = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds = min(seconds, time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {'units': units, 'seconds': seconds, 'throughput': units / seconds, 'peak_bytes': peak}
+
+
+def main() -> int:
+    parser = ArgumentParser(description='Benchmark gallop on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fractional slowdown against the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    baseline: dict = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results: dict[str, dict[str, dict[str, float]]] = {}
+    regressions = 0
+    print(f'{'benchmark':<34}{'size':>9}{'units/s':>14}{'seconds':>11}{'peak MiB':>10}  vs baseline')
+    for name in args.only:
+        results[name] = {}
+        for size in args.sizes:
+            result = run_benchmark(BENCHMARKS[name], size, args.repeat)
+            results[name][str(size)] = result
+            comparison = ''
+            previous = baseline.get(name, {}).get(str(size))
+            if previous:
+                change = result['seconds'] / previous['seconds'] - 1
+                comparison = f'{change:+.1%}'
+                if change > args.threshold:
+                    comparison += '  REGRESSION'
+                    regressions += 1
+            print(f'{name:<34}{size:>9}{result['throughput']:>14,.0f}{result['seconds']:>11.4f}'
+                  f'{result['peak_bytes'] / 2 ** 20:>10.1f}  {comparison}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
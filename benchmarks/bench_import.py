@@ -0,0 +1,86 @@
+#! python3
+'''
+Times importing gallop's modules in fresh interpreters, and lists the heavy dependencies each import drags in.
+
+    python benchmarks/bench_import.py --save import_baseline.json
+    python benchmarks/bench_import.py --baseline import_baseline.json
+
+With --baseline, any module whose import got more than --threshold slower is flagged and the exit status is 1.
+'''
+
+
+from argparse import ArgumentParser
+import json
+import os
+import subprocess
+import sys
+
+
+DEFAULT_MODULES: list[str] = ['gallop.pacecontainer', 'gallop.utility', 'gallop.speed', 'gallop.batch']
+DEFAULT_REPEAT: int = 5
+DEFAULT_THRESHOLD: float = 0.2
+HEAVY_MODULES: list[str] = ['pandas', 'scipy', 'brispy', 'chart_parser', 'horsedb2', 'pyarrow']
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a clean interpreter each time so nothing is already imported
+IMPORT_SCRIPT: str = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def time_import(module: str, repeat: int) -> dict:
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))}
+    seconds = float('inf')
+    loaded: list[str] = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True, env=env).stdout
+        result = json.loads(output.splitlines()[-1])
+        seconds = min(seconds, result['seconds'])
+        loaded = result['loaded']
+    return {'seconds': seconds, 'loaded': loaded}
+
+
+def main() -> int:
+    parser = ArgumentParser(description='Benchmark importing gallop')
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fractional slowdown against the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    baseline: dict = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results: dict[str, dict] = {}
+    regressions = 0
+    print(f'{'module':<26}{'seconds':>10}  {'vs baseline':<24}heavy imports')
+    for module in args.modules:
+        result = time_import(module, args.repeat)
+        results[module] = result
+        comparison = ''
+        previous = baseline.get(module)
+        if previous:
+            change = result['seconds'] / previous['seconds'] - 1
+            comparison = f'{change:+.1%}'
+            if change > args.threshold:
+                comparison += '  REGRESSION'
+                regressions += 1
+        print(f'{module:<26}{result['seconds']:>10.4f}  {comparison:<24}{', '.join(result['loaded']) or '-'}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
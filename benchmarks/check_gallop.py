@@ -0,0 +1,117 @@
+#! python3
+'''
+Checks that gallop's columnar paths give exactly what the object-at-a-time code they replace does, on
+synthetic data (see synthetic.py).
+
+    python benchmarks/check_gallop.py --size 20000
+
+Every mismatch is printed and the exit status is 1 if there were any.
+'''
+
+
+from argparse import ArgumentParser
+from collections.abc import Callable
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pandas import DataFrame  # noqa: E402
+
+import synthetic  # noqa: E402
+from bench_gallop import REFERENCE_DATE, synthetic_variants  # noqa: E402
+from gallop import utility  # noqa: E402
+from gallop.pacecontainer import (AVERAGE_COLUMNS, PaceContainer, PaceContainerPastPerformance,  # noqa: E402
+                                  average_pace_figures, pace_figures_from_dataframe)
+
+
+DEFAULT_SIZE: int = 20000
+
+
+Check = Callable[[list[synthetic.SyntheticSingleFile]], list[str]]
+
+
+def get_horses(singlefiles: list[synthetic.SyntheticSingleFile]) -> list[synthetic.SyntheticSingleFileHorse]:
+    return [row.horse for singlefile in singlefiles for row in singlefile.rows]
+
+
+def check_average_pace_figures(singlefiles: list[synthetic.SyntheticSingleFile]) -> list[str]:
+    '''
+    average_pace_figures against PaceContainer, over the PPs PaceContainer keeps.
+    '''
+    horses = get_horses(singlefiles)
+    records: list[dict] = []
+    for i, horse in enumerate(horses):
+        for pp in horse.past_performances:
+            if pp.track_code and int(pp.date[:4]) >= REFERENCE_DATE.year:
+                records.append({'horse': i, **vars(pp)})
+    sfpp_df = DataFrame(records)
+    pace_df = pace_figures_from_dataframe(sfpp_df).assign(horse=sfpp_df['horse'])
+    averages = average_pace_figures(pace_df, 'horse')
+    mismatches: list[str] = []
+    for i, horse in enumerate(horses):
+        pace_container = PaceContainer(horse, reference_date=REFERENCE_DATE)
+        expected = [getattr(pace_container, column) for column in AVERAGE_COLUMNS]
+        actual = averages.loc[i].tolist() if i in averages.index else [0] * len(AVERAGE_COLUMNS)
+        if actual != expected:
+            mismatches.append(f'{horse.name}: {actual} != {expected}')
+    return mismatches
+
+
+def is_same(actual: object, expected: object) -> bool:
+    # NaN counts as equal to NaN
+    return actual == expected or (actual != actual and expected != expected)
+
+
+def check_combined_dataframe(singlefiles: list[synthetic.SyntheticSingleFile]) -> list[str]:
+    '''
+    singlefile_to_combined_dataframe's PaceContainer columns against PaceContainerPastPerformance.
+    '''
+    mismatches: list[str] = []
+    for singlefile in singlefiles:
+        combined_df = utility.singlefile_to_combined_dataframe(singlefile)
+        pps = [pp for row in singlefile.rows if not utility.is_maiden(row.race) and row.horse.program_number
+               for pp in row.horse.past_performances
+               if pp.date and pp.distance / 220 <= 12 and int(pp.date[:4]) >= 2025]
+        if combined_df is None or len(combined_df) != len(pps):
+            mismatches.append(f'{len(pps)} past performances, got {0 if combined_df is None else len(combined_df)}')
+            continue
+        # speed_figure is only there with a ParIndex
+        columns = [name for name in PaceContainerPastPerformance.__slots__ if name != 'speed_figure']
+        if list(combined_df.columns[-len(columns):]) != columns:
+            mismatches.append(f'columns {list(combined_df.columns[-len(columns):])} != {columns}')
+            continue
+        for pp, actual in zip(pps, combined_df.iloc[:, -len(columns):].itertuples(index=False)):
+            expected = tuple(PaceContainerPastPerformance(pp).to_dict().values())
+            if not all(map(is_same, actual, expected)):
+                mismatches.append(f'{pp}: {tuple(actual)} != {expected}')
+    return mismatches
+
+
+CHECKS: dict[str, Check] = {
+    'average_pace_figures': check_average_pace_figures,
+    'singlefile_to_combined_dataframe': check_combined_dataframe,
+}
+
+
+def main() -> int:
+    parser = ArgumentParser(description='Check gallop\'s columnar paths against the scalar ones')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='number of past performances')
+    parser.add_argument('--only', nargs='+', choices=list(CHECKS), default=list(CHECKS))
+    args = parser.parse_args()
+
+    failures = 0
+    with synthetic_variants():
+        singlefiles = synthetic.create_singlefiles(args.size)
+        for name in args.only:
+            mismatches = CHECKS[name](singlefiles)
+            print(f'{name:<34}{'ok' if not mismatches else f'{len(mismatches)} mismatches'}')
+            for mismatch in mismatches[:10]:
+                print(f'    {mismatch}')
+            failures += bool(mismatches)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
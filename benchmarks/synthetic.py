@@ -0,0 +1,202 @@
+#! python3
+'''
+Synthetic stand-ins for brispy's SingleFile and chart_parser's Chart objects.
+
+They only carry the attributes gallop reads, and are deterministic for a given seed so runs compare.
+'''
+
+
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+import random
+
+from chart_parser.special_types import Course
+
+
+SYNTHETIC_TRACK_CODE: str = 'SYN'
+SYNTHETIC_START_DATE: date = date(2025, 1, 1)
+HORSES_PER_RACE: int = 10
+RACES_PER_DAY: int = 10
+PAST_PERFORMANCES_PER_HORSE: int = 10
+
+
+@dataclass
+class SyntheticPastPerformance:
+    date: str
+    track_code: str
+    distance: int
+    surface: str
+    start_code: str
+    all_weather_surface_flag: str
+    two_furlong_fraction: float
+    four_furlong_fraction: float
+    six_furlong_fraction: float
+    final_time: float
+    track_variant: int
+    first_call_beaten_lengths: float
+    second_call_beaten_lengths: float
+    finish_beaten_lengths: float
+    finish_position: str
+
+
+@dataclass
+class SyntheticSingleFileHorse:
+    name: str
+    program_number: str
+    past_performances: list[SyntheticPastPerformance]
+
+
+@dataclass
+class SyntheticSingleFileRace:
+    number: int
+    classification: str
+
+
+@dataclass
+class SyntheticSingleFileRow:
+    race: SyntheticSingleFileRace
+    horse: SyntheticSingleFileHorse
+
+
+@dataclass
+class SyntheticSingleFile:
+    rows: list[SyntheticSingleFileRow]
+
+
+@dataclass
+class SyntheticHorse:
+    name: str
+    post_position: int
+    odds: int
+    blf: float
+    finish: int
+
+    def is_winner(self) -> bool:
+        return self.finish == 1
+
+
+@dataclass
+class SyntheticRace:
+    number: int
+    abbreviated_race_name: str
+    class_codes: str
+    sex_restriction: str
+    age_restriction: str
+    distance: float
+    course_type: Course
+    track_condition: str
+    final: float
+    horses: list[SyntheticHorse] = field(default_factory=list)
+
+    def get_winner(self) -> SyntheticHorse:
+        return next(horse for horse in self.horses if horse.is_winner())
+
+
+@dataclass
+class SyntheticChartHeader:
+    race_date: date
+
+
+@dataclass
+class SyntheticChart:
+    header: SyntheticChartHeader
+    races: list[SyntheticRace]
+
+
+def get_horse_name(day: int, race_number: int, post_position: int) -> str:
+    return f'HORSE {day} {race_number} {post_position}'
+
+
+def create_past_performance(rng: random.Random) -> SyntheticPastPerformance:
+    furlongs = rng.choice([5.0, 5.5, 6.0, 6.5, 7.0, 8.0, 8.5, 9.0])
+    two = round(rng.uniform(21.5, 23.5), 2)
+    four = round(two + rng.uniform(22.5, 24.0), 2)
+    six = round(four + rng.uniform(23.5, 25.5), 2)
+    final = round(six + (furlongs - 6) * rng.uniform(12.0, 13.0), 2) if furlongs > 6 else \
+        round(four + (furlongs - 4) * rng.uniform(12.0, 13.0), 2)
+    bl1 = round(rng.uniform(0, 8) * 4) / 4
+    bl2 = round(rng.uniform(0, 10) * 4) / 4
+    bl3 = round(rng.uniform(0, 15) * 4) / 4
+    return SyntheticPastPerformance(
+        date=f'2025{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}',
+        track_code=rng.choice([SYNTHETIC_TRACK_CODE, SYNTHETIC_TRACK_CODE, 'ALT', '']),
+        distance=int(furlongs * 220),
+        surface=rng.choice(['D', 'D', 'D', 'T', 'd', 't']),
+        start_code=rng.choice(['', '', 'x']),
+        all_weather_surface_flag=rng.choice(['', '', '', 'A']),
+        two_furlong_fraction=rng.choice([two, two, two, 0.0]),
+        four_furlong_fraction=four,
+        six_furlong_fraction=six,
+        final_time=final,
+        track_variant=rng.randint(5, 30),
+        first_call_beaten_lengths=bl1,
+        second_call_beaten_lengths=bl2,
+        finish_beaten_lengths=bl3,
+        finish_position=str(rng.randint(1, 10)),
+    )
+
+
+def create_singlefile(day: int, rng: random.Random) -> SyntheticSingleFile:
+    rows: list[SyntheticSingleFileRow] = []
+    for race_number in range(1, RACES_PER_DAY + 1):
+        race = SyntheticSingleFileRace(race_number, 'MdSpWt' if race_number == 1 else 'Clm 25000')
+        for post_position in range(1, HORSES_PER_RACE + 1):
+            horse = SyntheticSingleFileHorse(
+                get_horse_name(day, race_number, post_position),
+                str(post_position),
+                [create_past_performance(rng) for _ in range(PAST_PERFORMANCES_PER_HORSE)]
+            )
+            rows.append(SyntheticSingleFileRow(race, horse))
+    return SyntheticSingleFile(rows)
+
+
+def create_chart(day: int, rng: random.Random) -> SyntheticChart:
+    races: list[SyntheticRace] = []
+    for race_number in range(1, RACES_PER_DAY + 1):
+        distance = rng.choice([5.5, 6.0, 6.5, 7.0, 8.5, 9.0])
+        race = SyntheticRace(
+            number=race_number,
+            abbreviated_race_name='Md Sp Wt' if race_number == 1 else 'Clm',
+            class_codes='C',
+            sex_restriction='',
+            age_restriction='3U',
+            distance=distance,
+            course_type=rng.choice([Course.DIRT, Course.DIRT, Course.TURF]),
+            track_condition=rng.choice(['FT', 'GD', 'SY']),
+            final=round(distance * 12.3 + rng.uniform(-1, 1), 2),
+        )
+        finishes = list(range(1, HORSES_PER_RACE + 1))
+        rng.shuffle(finishes)
+        for post_position, finish in enumerate(finishes, start=1):
+            race.horses.append(SyntheticHorse(
+                name=get_horse_name(day, race_number, post_position).lower(),
+                post_position=post_position,
+                odds=rng.choice([0, 90, 150, 250, 400, 800, 1500, 3000]),
+                blf=0.0 if finish == 1 else round(rng.uniform(0, 20) * 4) / 4,
+                finish=finish,
+            ))
+        races.append(race)
+    return SyntheticChart(SyntheticChartHeader(SYNTHETIC_START_DATE + timedelta(days=day)), races)
+
+
+def get_days(past_performances: int) -> int:
+    return max(1, past_performances // (RACES_PER_DAY * HORSES_PER_RACE * PAST_PERFORMANCES_PER_HORSE))
+
+
+def create_singlefiles(past_performances: int, seed: int = 0) -> list[SyntheticSingleFile]:
+    rng = random.Random(seed)
+    return [create_singlefile(day, rng) for day in range(get_days(past_performances))]
+
+
+def create_charts(days: int, seed: int = 0) -> list[SyntheticChart]:
+    rng = random.Random(seed)
+    return [create_chart(day, rng) for day in range(days)]
+
+
+def get_average_variant(track_code: str, distance: int, surface: str, all_weather_surface_flag: str) -> int:
+    '''
+    Local stand-in for horsedb2.variants.get_average_variant, raises for one track like a missing key would.
+    '''
+    if track_code == 'ALT':
+        raise KeyError(track_code)
+    return 10 + (distance // 110 + len(surface) + len(all_weather_surface_flag)) % 15
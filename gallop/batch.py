@@ -0,0 +1,213 @@
+#! python3
+
+
+from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from functools import partial
+import json
+import logging
+import os
+from typing import Any
+
+from gallop import instrument
+from gallop.cache import ParseCache, get_file_key
+from gallop.catalog import DataCatalog
+from gallop.utility import (DEFAULT_WORKERS, get_day_pace_data, get_day_path, get_rank_options_key,
+                            get_singlefile_dataframe, get_writable_dataframe, write_dataframe)
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MANIFEST_NAME: str = '_manifest.jsonl'
+
+
+Job = tuple[str, date | None, date | None]
+UnitResult = tuple[str | None, int]
+
+
+class WorkUnit:
+    '''
+    One track's day: its chart and its DRF (SingleFile) file.
+    '''
+    __slots__ = ('track_code', 'race_date', 'chart_path', 'pp_path')
+
+    def __init__(self, track_code: str, race_date: date, chart_path: str, pp_path: str):
+        self.track_code = track_code
+        self.race_date = race_date
+        self.chart_path = chart_path
+        self.pp_path = pp_path
+
+    def __str__(self):
+        return f'WorkUnit(track_code={self.track_code}, race_date={self.race_date})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def key(self) -> str:
+        return f'{self.track_code}/{self.race_date.strftime('%Y%m%d')}'
+
+    def get_fingerprint(self, rank_options: dict[str, Any] | None = None) -> str:
+        # The options are part of it, so changing them redoes the unit
+        return get_file_key(self.chart_path, self.pp_path, namespace=f'batch:{get_rank_options_key(rank_options)}')
+
+    def get_size(self) -> int:
+        return os.path.getsize(self.chart_path) + os.path.getsize(self.pp_path)
+
+
+def get_work_units(catalog: DataCatalog, jobs: Iterable[Job]) -> list[WorkUnit]:
+    '''
+    A unit for every day in each (track code, start, end) job (start and end inclusive, None for open ended)
+    that has both a chart and a DRF file.
+    '''
+    units: list[WorkUnit] = []
+    for (chart_track_code, race_date), chart_path in sorted(catalog.charts.items()):
+        for track_code, start, end in jobs:
+            if chart_track_code != track_code or (start is not None and race_date < start) or \
+                    (end is not None and race_date > end):
+                continue
+            pp_path = catalog.get_pp_path(track_code, race_date)
+            if pp_path is None:
+                instrument.count('charts_skipped', reason='no_drf')
+            else:
+                units.append(WorkUnit(track_code, race_date, chart_path, pp_path))
+            break
+    return units
+
+
+def get_unit_path(output_path: str, unit: WorkUnit) -> str:
+    return get_day_path(output_path, unit.track_code, unit.race_date)
+
+
+def run_unit(unit: WorkUnit, output_path: str, cache: ParseCache | None = None,
+             rank_options: dict[str, Any] | None = None) -> UnitResult:
+    '''
+    Ranks the unit's day (rank_options are passed on to rank_pace_data) and writes it out. Returns the path
+    written (None if the day had nothing to rank) and the number of rows.
+    '''
+    from chart_parser.utils import parse_chart
+
+    path = get_unit_path(output_path, unit)
+    with instrument.timer('parse_chart'):
+        chart = parse_chart(unit.chart_path)
+    instrument.count('charts_parsed')
+    day_df = get_day_pace_data(chart, get_singlefile_dataframe(unit.pp_path, cache), **(rank_options or {}))
+    if day_df is None:
+        # Don't leave an earlier run's output for a day that no longer has any
+        if os.path.exists(path):
+            os.remove(path)
+        return None, 0
+    write_dataframe(get_writable_dataframe(day_df), path)
+    return path, len(day_df)
+
+
+class BatchManifest:
+    '''
+    The units a batch has finished, with the fingerprint of the source files each was built from.
+
+    Kept as JSON lines that are appended to (and flushed to disk) as each unit finishes, so a crash loses at
+    most the line being written; the last line for a unit wins. compact() rewrites it with one line per unit.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry['unit']] = entry
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __str__(self):
+        return f'BatchManifest(path={self.path}, units={len(self.entries)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def is_done(self, unit: WorkUnit, fingerprint: str) -> bool:
+        entry = self.entries.get(unit.key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return entry['path'] is None or os.path.exists(entry['path'])
+
+    def record(self, unit: WorkUnit, fingerprint: str, path: str | None, rows: int) -> None:
+        entry = {'unit': unit.key, 'fingerprint': fingerprint, 'path': path, 'rows': rows}
+        self.entries[unit.key] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self) -> None:
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+def _finish_unit(manifest: BatchManifest, summary: dict[str, int], unit: WorkUnit, fingerprint: str,
+                 get_result: Callable[[], UnitResult]) -> None:
+    try:
+        path, rows = get_result()
+    except Exception:
+        logger.exception('%s failed', unit)
+        instrument.count('batch_units', reason='failed')
+        summary['failed'] += 1
+        return
+    manifest.record(unit, fingerprint, path, rows)
+    instrument.count('batch_units', reason='completed')
+    summary['completed'] += 1
+
+
+def run_batch(jobs: Iterable[Job], catalog: DataCatalog, output_path: str, workers: int = DEFAULT_WORKERS,
+              cache: ParseCache | None = None, manifest_path: str | None = None,
+              rank_options: dict[str, Any] | None = None) -> dict[str, int]:
+    '''
+    Writes every (track, day) unit of the jobs (see get_work_units) to output_path/track=<track code>/
+    year=<YYYY>/, one file per day.
+
+    Units the manifest (output_path/_manifest.jsonl by default) already has, built from the same source
+    files with the same rank_options (passed on to rank_pace_data), are skipped, so a rerun after a crash or
+    with new or changed files only does what's left. The rest go to a process pool biggest first and are
+    recorded as they finish, in whatever order that is. A failed unit is logged and left out of the
+    manifest to be retried next time. Returns how many units
+    there were, and how many were skipped, completed and failed.
+    '''
+    jobs = list(jobs)
+    manifest = BatchManifest(manifest_path or os.path.join(output_path, DEFAULT_MANIFEST_NAME))
+    units = get_work_units(catalog, jobs)
+    todo: list[tuple[WorkUnit, str]] = []
+    for unit in units:
+        fingerprint = unit.get_fingerprint(rank_options)
+        if not manifest.is_done(unit, fingerprint):
+            todo.append((unit, fingerprint))
+    # Longest first, so a big day isn't the last thing left running while the other workers sit idle
+    todo.sort(key=lambda item: item[0].get_size(), reverse=True)
+    summary = {'units': len(units), 'skipped': len(units) - len(todo), 'completed': 0, 'failed': 0}
+    instrument.count('batch_units', summary['skipped'], reason='skipped')
+    if workers <= 1:
+        for unit, fingerprint in todo:
+            _finish_unit(manifest, summary, unit, fingerprint,
+                         partial(run_unit, unit, output_path, cache, rank_options))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            enabled = instrument.INSTRUMENTATION.enabled
+            futures = {executor.submit(instrument.run_in_worker, enabled, run_unit, unit, output_path, cache,
+                                       rank_options): (unit, fingerprint)
+                       for unit, fingerprint in todo}
+            for future in as_completed(futures):
+                unit, fingerprint = futures[future]
+                _finish_unit(manifest, summary, unit, fingerprint, partial(instrument.get_worker_result, future))
+    if todo:
+        manifest.compact()
+    logger.info('Batch done: %s', summary)
+    return summary
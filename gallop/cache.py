@@ -0,0 +1,178 @@
+#! python3
+
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from enum import Enum
+from hashlib import sha1
+import json
+import os
+from typing import TYPE_CHECKING
+
+from gallop import instrument
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+DEFAULT_CACHE_SIZE: int = 2 * 1024 ** 3
+CACHE_VERSION: int = 1
+CACHE_EXTENSIONS: tuple[str, ...] = ('.parquet', '.pkl', '.none')
+COLUMNS_METADATA_KEY: bytes = b'gallop.columns'
+
+
+def get_file_key(*paths: str, namespace: str = '') -> str:
+    '''
+    A fingerprint of the files' paths, sizes and modification times, so it changes when any of them does.
+    '''
+    key = sha1(f'{CACHE_VERSION}:{namespace}'.encode())
+    for path in paths:
+        stat = os.stat(path)
+        key.update(f':{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return key.hexdigest()
+
+
+class ParseCache:
+    '''
+    On-disk cache of DataFrames derived from chart/DRF files.
+
+    Entries are keyed on the source files' paths, sizes and modification times (see get_key), so editing or
+    replacing a source file just makes its old entries unreachable; they age out with the rest. Frames are
+    stored as Parquet (duplicate column names, like the combined SingleFile frames have, are kept in the
+    file's metadata), falling back to pickle for anything Arrow can't hold. Hits bump the entry's mtime and
+    the oldest entries are evicted once the directory grows past max_bytes.
+    '''
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __str__(self):
+        return f'ParseCache(directory={self.directory}, max_bytes={self.max_bytes}, hits={self.hits}, ' \
+               f'misses={self.misses})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_key(self, *paths: str, namespace: str = '') -> str:
+        return get_file_key(*paths, namespace=namespace)
+
+    def _get_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f'{key}{extension}')
+
+    def _find(self, key: str) -> str | None:
+        for extension in CACHE_EXTENSIONS:
+            path = self._get_path(key, extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) is not None
+
+    def get(self, key: str, enums: dict[str, type[Enum]] | None = None) -> DataFrame | None:
+        '''
+        Raises KeyError on a miss. A cached None comes back as None. Columns named in enums were stored as
+        member names and are turned back into members.
+        '''
+        path = self._find(key)
+        if path is None:
+            self.misses += 1
+            instrument.count('parse_cache_misses')
+            raise KeyError(key)
+        self.hits += 1
+        instrument.count('parse_cache_hits')
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        if path.endswith('.none'):
+            return None
+        if path.endswith('.pkl'):
+            from pandas import read_pickle
+            return read_pickle(path)
+        return _read_parquet(path, enums or {})
+
+    def put(self, key: str, df: DataFrame | None) -> None:
+        if df is None:
+            path = self._get_path(key, '.none')
+            open(path, 'w').close()
+        else:
+            path = self._get_path(key, '.parquet')
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            try:
+                _write_parquet(df, tmp_path)
+            except (ImportError, NotImplementedError, TypeError, ValueError):
+                path = self._get_path(key, '.pkl')
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        self.evict()
+
+    def get_or_create(self, key: str, create: Callable[[], DataFrame | None],
+                      enums: dict[str, type[Enum]] | None = None) -> DataFrame | None:
+        try:
+            return self.get(key, enums)
+        except KeyError:
+            df = create()
+            self.put(key, df)
+            return df
+
+    def evict(self) -> None:
+        entries: list[os.DirEntry] = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(CACHE_EXTENSIONS):
+                    try:
+                        total += entry.stat().st_size
+                    except FileNotFoundError:
+                        continue
+                    entries.append(entry)
+        if total <= self.max_bytes:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                total -= entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(CACHE_EXTENSIONS):
+                    os.remove(entry.path)
+
+
+def _write_parquet(df: DataFrame, path: str) -> None:
+    import pyarrow
+    from pyarrow import parquet
+
+    columns = list(df.columns)
+    df = df.set_axis([str(i) for i in range(len(columns))], axis=1)
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object and any(isinstance(value, Enum) for value in values):
+            df[column] = values.map(lambda member: member.name if isinstance(member, Enum) else member)
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), COLUMNS_METADATA_KEY: json.dumps(columns).encode()}
+    parquet.write_table(table.replace_schema_metadata(metadata), path)
+
+
+def _read_parquet(path: str, enums: dict[str, type[Enum]]) -> DataFrame:
+    from pyarrow import parquet
+
+    table = parquet.read_table(path, memory_map=True)
+    columns = json.loads(table.schema.metadata[COLUMNS_METADATA_KEY])
+    df = table.to_pandas()
+    for i, column in enumerate(columns):
+        if column in enums:
+            enum = enums[column]
+            df[str(i)] = df[str(i)].map(lambda name: None if name is None else enum[name])
+    return df.set_axis(columns, axis=1)
@@ -0,0 +1,129 @@
+#! python3
+
+
+from datetime import date, datetime
+import os
+import re
+
+
+CHART_FILE_PATTERN: re.Pattern = re.compile(r'^(\D+)(\d{8})\.chart$')
+PP_FILE_PATTERN: re.Pattern = re.compile(r'^(\D+)(\d{4})\.drf$')
+YEAR_DIR_PATTERN: re.Pattern = re.compile(r'^\d{4}$')
+
+
+CatalogKey = tuple[str, date]
+
+
+def get_pp_track_code(track_code: str) -> str:
+    '''
+    DRF file names always use three character track codes, two character ones are padded with an X.
+    '''
+    if len(track_code) == 2:
+        track_code += 'X'
+    return track_code
+
+
+class DataCatalog:
+    '''
+    In-memory index of chart and DRF (SingleFile) files keyed on (track code, date).
+
+    Charts are named <track code>YYYYmmdd.chart and can be anywhere under the chart roots. DRF files are named
+    <track code>mmdd.drf and take their year from the closest parent directory named YYYY. Directories are
+    walked with os.scandir, and rescan() only relists directories whose mtime has changed since the last scan.
+    '''
+    def __init__(self, chart_roots: list[str] | str, pp_roots: list[str] | str):
+        self.chart_roots = [chart_roots] if isinstance(chart_roots, str) else list(chart_roots)
+        self.pp_roots = [pp_roots] if isinstance(pp_roots, str) else list(pp_roots)
+        self.charts: dict[CatalogKey, str] = {}
+        self.pps: dict[CatalogKey, str] = {}
+        self._dir_mtimes: dict[str, int] = {}
+        self._dir_keys: dict[str, list[tuple[dict[CatalogKey, str], CatalogKey]]] = {}
+        self._dir_subdirs: dict[str, list[str]] = {}
+        self.rescan()
+
+    def __str__(self):
+        return f'DataCatalog(charts={len(self.charts)}, pps={len(self.pps)}, directories={len(self._dir_mtimes)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def rescan(self) -> None:
+        seen: set[str] = set()
+        for root in self.chart_roots:
+            self._scan_dir(os.path.abspath(root), None, seen)
+        for root in self.pp_roots:
+            root = os.path.abspath(root)
+            year = int(os.path.basename(root)) if YEAR_DIR_PATTERN.match(os.path.basename(root)) else None
+            self._scan_dir(root, year, seen)
+        # Forget anything from directories that have gone away
+        for dir_path in list(self._dir_mtimes):
+            if dir_path not in seen:
+                self._forget_dir(dir_path)
+
+    def _forget_dir(self, dir_path: str) -> None:
+        for index, key in self._dir_keys.pop(dir_path, []):
+            index.pop(key, None)
+        self._dir_mtimes.pop(dir_path, None)
+        self._dir_subdirs.pop(dir_path, None)
+
+    def _scan_dir(self, dir_path: str, year: int | None, seen: set[str]) -> None:
+        if dir_path in seen:
+            return
+        seen.add(dir_path)
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if self._dir_mtimes.get(dir_path) != mtime:
+            self._forget_dir(dir_path)
+            keys: list[tuple[dict[CatalogKey, str], CatalogKey]] = []
+            subdirs: list[str] = []
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                        continue
+                    match = CHART_FILE_PATTERN.match(entry.name)
+                    if match:
+                        try:
+                            key = (match[1], datetime.strptime(match[2], '%Y%m%d').date())
+                        except ValueError:
+                            continue
+                        self.charts[key] = entry.path
+                        keys.append((self.charts, key))
+                        continue
+                    match = PP_FILE_PATTERN.match(entry.name)
+                    if match and year is not None:
+                        try:
+                            key = (match[1], datetime.strptime(f'{year}{match[2]}', '%Y%m%d').date())
+                        except ValueError:
+                            continue
+                        self.pps[key] = entry.path
+                        keys.append((self.pps, key))
+            self._dir_mtimes[dir_path] = mtime
+            self._dir_keys[dir_path] = keys
+            self._dir_subdirs[dir_path] = subdirs
+        for subdir in self._dir_subdirs[dir_path]:
+            name = os.path.basename(subdir)
+            self._scan_dir(subdir, int(name) if YEAR_DIR_PATTERN.match(name) else year, seen)
+
+    def get_chart_paths(self, track_code: str, root: str | None = None) -> list[str]:
+        '''
+        Every chart for the track in date order, optionally only those under root.
+        '''
+        if root is not None:
+            root = os.path.abspath(root)
+        chart_paths: list[str] = []
+        for (chart_track_code, _), chart_path in sorted(self.charts.items()):
+            if chart_track_code != track_code:
+                continue
+            if root is not None and os.path.commonpath([root, chart_path]) != root:
+                continue
+            chart_paths.append(chart_path)
+        return chart_paths
+
+    def get_pp_path(self, track_code: str, race_date: date) -> str | None:
+        return self.pps.get((get_pp_track_code(track_code), race_date))
+
+    def check_if_pp_exists(self, track_code: str, race_date: date) -> bool:
+        return (get_pp_track_code(track_code), race_date) in self.pps
@@ -0,0 +1,195 @@
+#! python3
+
+
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+import json
+import time
+
+
+TIMER_FIELDS: tuple[str, ...] = ('calls', 'total_seconds', 'max_seconds')
+STAGE_METRICS: tuple[tuple[str, str], ...] = (
+    ('stage_calls_total', 'counter'),
+    ('stage_seconds_total', 'counter'),
+    ('stage_seconds_max', 'gauge'),
+)
+
+
+# What a worker process recorded, see get_snapshot and merge
+Snapshot = tuple[dict[str, list[float]], dict[tuple[str, str], int]]
+
+
+class _NullTimer:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NULL_TIMER: _NullTimer = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ('instrumentation', 'stage', 'start')
+
+    def __init__(self, instrumentation: 'Instrumentation', stage: str):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self.instrumentation.add_time(self.stage, time.perf_counter() - self.start)
+
+
+class Instrumentation:
+    '''
+    Opt-in stage timers and counters for the ingestion and pace pipeline.
+
+    Everything is off until enabled; while disabled timer() hands back a shared no-op context manager and
+    count() returns straight away. The numbers are per process; work sent to a process pool through
+    run_in_worker and get_worker_result (as ordered_map and run_batch do) brings its numbers back to be
+    merged into the parent's, so a timer's total_seconds adds up the time spent in every worker.
+    '''
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.timers: dict[str, list[float]] = {}
+        self.counters: dict[tuple[str, str], int] = {}
+
+    def __str__(self):
+        return f'Instrumentation(enabled={self.enabled}, timers={len(self.timers)}, counters={len(self.counters)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def reset(self) -> None:
+        self.timers.clear()
+        self.counters.clear()
+
+    def timer(self, stage: str) -> _NullTimer | _StageTimer:
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        totals = self.timers.get(stage)
+        if totals is None:
+            self.timers[stage] = [1, seconds, seconds]
+        else:
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    def count(self, name: str, value: int = 1, reason: str = '') -> None:
+        if not self.enabled:
+            return
+        key = (name, reason)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_snapshot(self) -> Snapshot:
+        return {stage: list(totals) for stage, totals in self.timers.items()}, dict(self.counters)
+
+    def merge(self, snapshot: Snapshot) -> None:
+        '''
+        Adds another process's timers and counters (see get_snapshot) to these.
+        '''
+        timers, counters = snapshot
+        for stage, (calls, total_seconds, max_seconds) in timers.items():
+            totals = self.timers.get(stage)
+            if totals is None:
+                self.timers[stage] = [calls, total_seconds, max_seconds]
+            else:
+                totals[0] += calls
+                totals[1] += total_seconds
+                totals[2] = max(totals[2], max_seconds)
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self) -> dict:
+        counters: dict[str, int | dict[str, int]] = {}
+        for (name, reason), value in sorted(self.counters.items()):
+            if reason:
+                reasons = counters.setdefault(name, {})
+                reasons[reason] = value  # type: ignore
+            else:
+                counters[name] = value
+        return {
+            'timers': {stage: dict(zip(TIMER_FIELDS, totals)) for stage, totals in sorted(self.timers.items())},
+            'counters': counters,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def _get_prometheus_lines(self, prefix: str) -> Iterator[str]:
+        for i, (metric, metric_type) in enumerate(STAGE_METRICS):
+            yield f'# TYPE {prefix}_{metric} {metric_type}'
+            for stage, totals in sorted(self.timers.items()):
+                yield f'{prefix}_{metric}{{stage="{stage}"}} {totals[i]}'
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            metric = f'{prefix}_{name}_total'
+            yield f'# TYPE {metric} counter'
+            for (counter_name, reason), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    yield f'{metric}{{reason="{reason}"}} {value}' if reason else f'{metric} {value}'
+
+    def to_prometheus(self, prefix: str = 'gallop') -> str:
+        '''
+        Prometheus text exposition format, e.g. for node_exporter's textfile collector.
+        '''
+        return '\n'.join(self._get_prometheus_lines(prefix)) + '\n'
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    def write_prometheus(self, path: str, prefix: str = 'gallop') -> None:
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+
+
+INSTRUMENTATION: Instrumentation = Instrumentation()
+
+
+def enable() -> None:
+    INSTRUMENTATION.enabled = True
+
+
+def disable() -> None:
+    INSTRUMENTATION.enabled = False
+
+
+def timer(stage: str) -> _NullTimer | _StageTimer:
+    return INSTRUMENTATION.timer(stage)
+
+
+def count(name: str, value: int = 1, reason: str = '') -> None:
+    INSTRUMENTATION.count(name, value, reason)
+
+
+def run_in_worker[R](enabled: bool, function: Callable[..., R], *args) -> tuple[R, Snapshot | None]:
+    '''
+    Calls function in a pool worker, with instrumentation on if the parent (which passes enabled) has it on.
+    Returns the result along with what the call recorded, for get_worker_result to merge in the parent.
+    '''
+    if not enabled:
+        return function(*args), None
+    # Start from nothing, a forked worker has a copy of the parent's numbers and a reused one has its last call's
+    INSTRUMENTATION.enabled = True
+    INSTRUMENTATION.reset()
+    result = function(*args)
+    return result, INSTRUMENTATION.get_snapshot()
+
+
+def get_worker_result[R](future: Future[tuple[R, Snapshot | None]]) -> R:
+    '''
+    The result of a run_in_worker call, merging what the worker recorded into INSTRUMENTATION.
+    '''
+    result, snapshot = future.result()
+    if snapshot is not None:
+        INSTRUMENTATION.merge(snapshot)
+    return result
@@ -0,0 +1,278 @@
+#! python3
+
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import date
+from inspect import isawaitable
+import logging
+import os
+from typing import TYPE_CHECKING
+
+from gallop import instrument
+from gallop.catalog import DataCatalog
+from gallop.pacecontainer import AVERAGE_COLUMNS, PaceContainer
+from gallop.pars import ParIndex
+from gallop.utility import get_scratch_set
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+    from brispy.singlefile import SingleFile, SingleFileHorse
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_POLL_INTERVAL: float = 1.0
+DEFAULT_SCRATCH_HOST: str = '127.0.0.1'
+DEFAULT_SCRATCH_PORT: int = 8765
+LIVE_RANKING_COLUMNS: list[str] = ['todays_race_number', 'horseno', 'name', *AVERAGE_COLUMNS]
+
+
+Publisher = Callable[[int, 'DataFrame'], Awaitable[None] | None]
+FileFingerprint = tuple[int, int]
+
+
+def get_file_fingerprint(path: str) -> FileFingerprint | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def read_scratches(path: str) -> frozenset[str]:
+    '''
+    One horse name per line; blank lines and lines starting with # are ignored.
+    '''
+    with open(path) as f:
+        return get_scratch_set(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
+
+class LiveEntry:
+    '''
+    One horse in today's race, with its pace averages worked out once.
+    '''
+    __slots__ = ('name', 'program_number', 'fingerprint', 'averages')
+
+    def __init__(self, horse: SingleFileHorse, fingerprint: list[dict], reference_date: date,
+                 par_index: ParIndex | None = None):
+        self.name = horse.name
+        self.program_number = horse.program_number
+        self.fingerprint = fingerprint
+        pace_container = PaceContainer(horse, reference_date=reference_date, par_index=par_index)
+        self.averages = tuple(getattr(pace_container, column) for column in AVERAGE_COLUMNS)
+
+    def __str__(self):
+        return f'LiveEntry(name={self.name}, program_number={self.program_number})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class LiveRace:
+    '''
+    The entries for one of today's races, keyed on their casefolded names.
+    '''
+    __slots__ = ('number', 'entries')
+
+    def __init__(self, number: int):
+        self.number = number
+        self.entries: dict[str, LiveEntry] = {}
+
+    def __str__(self):
+        return f'LiveRace(number={self.number}, entries={len(self.entries)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def update(self, horses: Iterable[SingleFileHorse], reference_date: date,
+               par_index: ParIndex | None = None) -> bool:
+        '''
+        Replaces the entries with horses, only redoing the pace averages of horses whose past performances have
+        changed. Returns whether anything changed.
+        '''
+        entries: dict[str, LiveEntry] = {}
+        changed = False
+        for horse in horses:
+            key = horse.name.casefold()
+            fingerprint = [vars(pp) for pp in horse.past_performances]
+            entry = self.entries.get(key)
+            if entry is None or entry.fingerprint != fingerprint or entry.program_number != horse.program_number:
+                entry = LiveEntry(horse, fingerprint, reference_date, par_index)
+                changed = True
+            entries[key] = entry
+        changed = changed or entries.keys() != self.entries.keys()
+        self.entries = entries
+        return changed
+
+    def rank(self, scratches: frozenset[str] | set[str]) -> DataFrame:
+        '''
+        Ranks every pace average among the horses that haven't scratched, best first.
+        '''
+        from pandas import DataFrame, concat
+
+        df = DataFrame([[self.number, entry.program_number, entry.name, *entry.averages]
+                        for key, entry in self.entries.items() if key not in scratches],
+                       columns=LIVE_RANKING_COLUMNS)
+        ranks = df[AVERAGE_COLUMNS].rank(method='average', ascending=False)
+        return concat([df, ranks.add_prefix('rank_')], axis=1)
+
+
+class LiveRaceDay:
+    '''
+    Keeps one track's card up to date on race day and publishes each race's rankings whenever they change.
+
+    The DRF (SingleFile) file is found through a DataCatalog over pp_roots and reparsed, off the event loop,
+    whenever its size or mtime changes; only horses whose past performances changed get their averages redone,
+    and only races whose entries changed are re-ranked. Scratches come from scratches_path (one name per line,
+    reread when it changes) and from clients of serve_scratches(), and only re-rank the races they touch.
+    publish is called (and awaited, if it returns an awaitable) with the race number and its new rankings.
+    '''
+    def __init__(self, track_code: str, race_date: date, pp_roots: list[str] | str,
+                 scratches_path: str | None = None, publish: Publisher | None = None,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, par_index: ParIndex | None = None):
+        self.track_code = track_code
+        self.race_date = race_date
+        self.catalog = DataCatalog([], pp_roots)
+        self.scratches_path = scratches_path
+        self.publish = publish
+        self.poll_interval = poll_interval
+        self.par_index = par_index
+        self.races: dict[int, LiveRace] = {}
+        self.rankings: dict[int, DataFrame] = {}
+        self.file_scratches: frozenset[str] = frozenset()
+        self.feed_scratches: frozenset[str] = frozenset()
+        self._pp_fingerprint: FileFingerprint | None = None
+        self._scratches_fingerprint: FileFingerprint | None = None
+
+    def __str__(self):
+        return f'LiveRaceDay(track_code={self.track_code}, race_date={self.race_date}, races={len(self.races)}, ' \
+               f'scratches={len(self.scratches)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def scratches(self) -> frozenset[str]:
+        return self.file_scratches | self.feed_scratches
+
+    def load_singlefile(self, single_file: SingleFile) -> set[int]:
+        '''
+        Brings the races up to date with single_file. Returns the numbers of the races that changed.
+        '''
+        card: dict[int, list[SingleFileHorse]] = {}
+        for row in single_file.rows:
+            horses = card.setdefault(row.race.number, [])
+            if row.horse:
+                horses.append(row.horse)
+        for number in set(self.races) - set(card):
+            del self.races[number]
+            self.rankings.pop(number, None)
+        affected: set[int] = set()
+        for number, horses in card.items():
+            race = self.races.get(number)
+            if race is None:
+                race = self.races[number] = LiveRace(number)
+            if race.update(horses, self.race_date, self.par_index):
+                affected.add(number)
+        return affected
+
+    def set_scratches(self, file_scratches: Iterable[str] | None = None,
+                      feed_scratches: Iterable[str] | None = None) -> set[int]:
+        '''
+        Replaces either (or both) sets of scratches. Returns the numbers of the races with a horse whose status
+        changed.
+        '''
+        scratches = self.scratches
+        if file_scratches is not None:
+            self.file_scratches = get_scratch_set(file_scratches)
+        if feed_scratches is not None:
+            self.feed_scratches = get_scratch_set(feed_scratches)
+        changed = scratches ^ self.scratches
+        if not changed:
+            return set()
+        return {number for number, race in self.races.items() if not changed.isdisjoint(race.entries)}
+
+    async def publish_races(self, race_numbers: Iterable[int]) -> None:
+        scratches = self.scratches
+        for number in sorted(race_numbers):
+            race = self.races.get(number)
+            if race is None:
+                continue
+            with instrument.timer('live_rank'):
+                rankings = race.rank(scratches)
+            self.rankings[number] = rankings
+            instrument.count('live_races_ranked')
+            if self.publish is not None:
+                result = self.publish(number, rankings)
+                if isawaitable(result):
+                    await result
+
+    async def poll(self) -> set[int]:
+        '''
+        Picks up a new or changed DRF file and scratches file and publishes the races they affect. Returns
+        the numbers of those races.
+        '''
+        affected: set[int] = set()
+        self.catalog.rescan()
+        pp_path = self.catalog.get_pp_path(self.track_code, self.race_date)
+        fingerprint = None if pp_path is None else get_file_fingerprint(pp_path)
+        if fingerprint is not None and fingerprint != self._pp_fingerprint:
+            from brispy.singlefile import SingleFile
+
+            with instrument.timer('live_parse_drf'):
+                single_file = await asyncio.to_thread(SingleFile.create, pp_path)
+            with instrument.timer('live_update'):
+                affected |= self.load_singlefile(single_file)
+            self._pp_fingerprint = fingerprint
+            logger.info('Loaded %s, %d races changed', pp_path, len(affected))
+        if self.scratches_path is not None:
+            fingerprint = get_file_fingerprint(self.scratches_path)
+            if fingerprint != self._scratches_fingerprint:
+                file_scratches = frozenset() if fingerprint is None else read_scratches(self.scratches_path)
+                affected |= self.set_scratches(file_scratches=file_scratches)
+                self._scratches_fingerprint = fingerprint
+        await self.publish_races(affected)
+        return affected
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        '''
+        Polls every poll_interval seconds until stop is set.
+        '''
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception('Live update for %s %s failed', self.track_code, self.race_date)
+            try:
+                await asyncio.wait_for(stop.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+
+    async def serve_scratches(self, host: str = DEFAULT_SCRATCH_HOST,
+                              port: int = DEFAULT_SCRATCH_PORT) -> asyncio.Server:
+        '''
+        Listens for scratches, one horse name per line; a name starting with - is put back in.
+        '''
+        return await asyncio.start_server(self._handle_scratches, host, port)
+
+    async def _handle_scratches(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            async for line in reader:
+                name = line.decode().strip()
+                if not name:
+                    continue
+                if name.startswith('-'):
+                    feed_scratches = self.feed_scratches - {name[1:].strip().casefold()}
+                else:
+                    feed_scratches = self.feed_scratches | {name.casefold()}
+                    logger.info('Scratch: %s', name)
+                await self.publish_races(self.set_scratches(feed_scratches=feed_scratches))
+        finally:
+            writer.close()
+            await writer.wait_closed()
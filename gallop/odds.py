@@ -0,0 +1,154 @@
+#! python3
+
+
+from __future__ import annotations
+
+import csv
+from typing import TYPE_CHECKING
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+DEFAULT_TAKEOUT: float = 0.2
+WIN_POOL: str = 'win'
+ANY_TRACK: str = '*'
+# Charts carry odds to 1 in hundredths, 250 is 5-2
+CHART_ODDS_SCALE: float = 100.0
+TAKEOUT_TABLE_FIELDS: list[str] = ['track_code', 'pool', 'takeout']
+ODDS_COLUMNS: list[str] = ['implied_probability', 'overround', 'normalized_probability', 'takeout',
+                           'takeout_probability', 'fair_odds']
+
+
+class TakeoutTable:
+    '''
+    Takeout by (track, pool). A track without its own entry for a pool gets the pool's ANY_TRACK entry, and
+    failing that the default.
+    '''
+    def __init__(self, takeouts: dict[tuple[str, str], float] | None = None, default: float = DEFAULT_TAKEOUT):
+        self.default = default
+        self.takeouts: dict[tuple[str, str], float] = {}
+        for (track_code, pool), takeout in (takeouts or {}).items():
+            self.set(track_code, pool, takeout)
+
+    def __len__(self) -> int:
+        return len(self.takeouts)
+
+    def __str__(self):
+        return f'TakeoutTable(takeouts={len(self.takeouts)}, default={self.default})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def set(self, track_code: str, pool: str, takeout: float) -> None:
+        if not 0 <= takeout < 1:
+            raise ValueError(f'Takeout must be in [0, 1): {takeout}')
+        self.takeouts[(track_code.strip().upper(), pool.casefold())] = takeout
+
+    def get(self, track_code: str | None, pool: str = WIN_POOL) -> float:
+        pool = pool.casefold()
+        if track_code:
+            takeout = self.takeouts.get((track_code.strip().upper(), pool))
+            if takeout is not None:
+                return takeout
+        return self.takeouts.get((ANY_TRACK, pool), self.default)
+
+    def get_takeouts(self, track_codes: ArrayLike, pool: str = WIN_POOL) -> NDArray[np.float64]:
+        '''
+        get() for every track code, looking each distinct one up once.
+        '''
+        uniques, inverse = np.unique(np.asarray(track_codes, dtype=object).astype(str), return_inverse=True)
+        return np.array([self.get(track_code, pool) for track_code in uniques], dtype=np.float64)[inverse]
+
+    @classmethod
+    def load(cls, path: str, default: float = DEFAULT_TAKEOUT) -> TakeoutTable:
+        '''
+        Reads a CSV table with a TAKEOUT_TABLE_FIELDS header. Takeouts are fractions, 0.16 for 16%.
+        '''
+        table = cls(default=default)
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                table.set(row['track_code'], row['pool'], float(row['takeout']))
+        return table
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TAKEOUT_TABLE_FIELDS)
+            for (track_code, pool), takeout in self.takeouts.items():
+                writer.writerow([track_code, pool, takeout])
+
+
+DEFAULT_TAKEOUT_TABLE: TakeoutTable = TakeoutTable()
+
+
+def get_implied_probabilities(odds: ArrayLike) -> NDArray[np.float64]:
+    '''
+    1 / (1 + odds) for odds to 1. Missing (NaN) and non-positive odds come out NaN.
+    '''
+    odds = np.asarray(odds, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return np.where(odds > 0, 1.0 / (1.0 + odds), np.nan)
+
+
+def get_overrounds(probabilities: ArrayLike, race_ids: ArrayLike) -> NDArray[np.float64]:
+    '''
+    Every row's race total of probabilities (NaNs left out); roughly 1 / (1 - takeout) for a tote board's
+    implied probabilities.
+    '''
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    _, inverse = np.unique(np.asarray(race_ids), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.nan_to_num(probabilities, nan=0.0))
+    return totals[inverse]
+
+
+def get_takeout_probabilities(odds: ArrayLike, takeouts: ArrayLike | float) -> NDArray[np.float64]:
+    '''
+    Each horse's share of the pool, (1 - takeout) / (1 + odds), since the tote pays (1 - takeout) / share
+    per dollar. Breakage is ignored.
+    '''
+    return get_implied_probabilities(odds) * (1.0 - np.asarray(takeouts, dtype=np.float64))
+
+
+def get_fair_odds(probabilities: ArrayLike) -> NDArray[np.float64]:
+    '''
+    The odds to 1 a probability is worth with no takeout.
+    '''
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1.0 / probabilities - 1.0
+
+
+def add_odds_columns(df: DataFrame, race_columns: str | list[str], odds_column: str = 'odds',
+                     scale: float = CHART_ODDS_SCALE, takeouts: TakeoutTable | None = None,
+                     track_code: str | None = None, track_column: str | None = None,
+                     pool: str = WIN_POOL) -> DataFrame:
+    '''
+    Adds the ODDS_COLUMNS for every row of df in one pass, with the rows sharing race_columns making up a
+    field. odds_column / scale should be odds to 1 (chart odds are in hundredths); missing or zero odds give
+    NaNs and are left out of their race's overround.
+
+    implied_probability is 1 / (1 + odds), overround the race total of those and normalized_probability the
+    implied probability with the overround taken out (so a race's add up to 1). takeout is looked up in
+    takeouts (DEFAULT_TAKEOUT_TABLE by default) for track_column's track, or track_code for every row;
+    takeout_probability is the horse's share of the pool net of it and fair_odds the odds to 1 that share is
+    worth.
+    '''
+    if takeouts is None:
+        takeouts = DEFAULT_TAKEOUT_TABLE
+    race_ids = df.groupby(race_columns, sort=False, dropna=False).ngroup().to_numpy()
+    odds = df[odds_column].to_numpy(dtype=np.float64) / scale
+    implied = get_implied_probabilities(odds)
+    overround = get_overrounds(implied, race_ids)
+    if track_column is not None:
+        takeout = takeouts.get_takeouts(df[track_column].to_numpy(), pool)
+    else:
+        takeout = np.full(len(df), takeouts.get(track_code, pool))
+    takeout_probability = get_takeout_probabilities(odds, takeout)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = implied / overround
+    return df.assign(**dict(zip(ODDS_COLUMNS, (implied, overround, normalized, takeout, takeout_probability,
+                                               get_fair_odds(takeout_probability)))))
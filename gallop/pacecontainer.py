@@ -1,33 +1,62 @@
 #! python3
 
 
+from __future__ import annotations
+
 from datetime import date
-from math import ceil, floor
+import logging
+from math import ceil, floor, isfinite
+from typing import TYPE_CHECKING
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+from gallop import instrument
+from gallop.pars import ParIndex, get_speed_figure
+from gallop.variants import get_average_variant
+
+# pandas, brispy and chart_parser are slow to import, so they're imported where they're first needed
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
-from brispy.singlefile import SingleFileHorse, SingleFilePastPerformance
-from chart_parser.special_types import Course
-from horsedb2.variants import get_average_variant
+    from brispy.singlefile import SingleFileHorse, SingleFilePastPerformance
+    from chart_parser.special_types import Course
+
+
+logger = logging.getLogger(__name__)
 
 
 DEFAULT_MIN_ROUTE_DISTANCE: float = 8.0
+PACE_FIGURE_COLUMNS: list[str] = ['f1', 'f2', 'f3', 'ep', 'sp', 'ap', 'fx', 'energy']
+AVERAGE_COLUMNS: list[str] = ['average_fr1', 'average_fr2', 'average_fr3', 'average_ep', 'average_sp', 'average_ap',
+                              'average_energy']
 
 
 class PaceContainerPastPerformance:
-    def __init__(self, sfpp: SingleFilePastPerformance):
+    # Slotted, we hold one of these for every PP of every entrant. The order matches the order the
+    # attributes are set in __init__, which is the order to_dict()/__repr__ use. speed_figure is only set
+    # when a ParIndex is given.
+    __slots__ = ('distance', 'course', 't1', 't2', 't3', 'track_variant', 'average_variant', 'bl1', 'bl2', 'bl3',
+                 'winner', *PACE_FIGURE_COLUMNS, 'speed_figure')
+
+    def __init__(self, sfpp: SingleFilePastPerformance, par_index: ParIndex | None = None):
+        from chart_parser import special_types
+
         self.distance = round(abs(sfpp.distance) / 220.0, 2)
         if (sfpp.surface == 'D' or (sfpp.surface == 'T' and 'x' in sfpp.start_code)) and \
                 sfpp.all_weather_surface_flag != 'A':
-            self.course: Course | None = Course.DIRT
+            self.course: Course | None = special_types.Course.DIRT
         elif sfpp.surface == 'D' and sfpp.all_weather_surface_flag == 'A':
-            self.course: Course | None = Course.ALL_WEATHER_TRACK
+            self.course: Course | None = special_types.Course.ALL_WEATHER_TRACK
         elif sfpp.surface == 'T':
-            self.course: Course | None = Course.TURF
+            self.course: Course | None = special_types.Course.TURF
         elif sfpp.surface == 'd':
-            self.course: Course | None = Course.INNER_TURF
+            self.course: Course | None = special_types.Course.INNER_TURF
         elif sfpp.surface == 't':
-            self.course: Course | None = Course.OUTER_TURF
+            self.course: Course | None = special_types.Course.OUTER_TURF
         else:
-            print(sfpp.surface)
+            logger.warning('Unknown surface: %r', sfpp.surface)
+            instrument.count('unknown_surfaces')
             self.course: Course | None = None
         self.t1 = sfpp.two_furlong_fraction if self.distance < DEFAULT_MIN_ROUTE_DISTANCE \
             else sfpp.four_furlong_fraction
@@ -36,12 +65,8 @@ class PaceContainerPastPerformance:
         self.t3 = sfpp.final_time
         self.track_variant = sfpp.track_variant
         if sfpp.track_code:
-            try:
-                self.average_variant = int(get_average_variant(sfpp.track_code, sfpp.distance, sfpp.surface,
-                                                               sfpp.all_weather_surface_flag))
-            except Exception as e:
-                print(e)
-                self.average_variant = 17
+            self.average_variant = get_average_variant(sfpp.track_code, sfpp.distance, sfpp.surface,
+                                                       sfpp.all_weather_surface_flag)
         else:
             self.average_variant = 0
         self.bl1 = sfpp.first_call_beaten_lengths
@@ -116,62 +141,382 @@ class PaceContainerPastPerformance:
                 self.fx = round((self.f1 + self.f3) / 2, 2)
                 self.energy = round(self.ep / (self.ep + self.f3), 4)
 
+        if par_index is not None:
+            self.speed_figure = self._get_speed_figure(sfpp.track_code, par_index)
+
     def __str__(self):
         ret = ''
-        for k, v in vars(self).items():
+        for k, v in self.to_dict().items():
             ret += f'{k}={v}, '
         return f'PaceContainerPastPerformance({ret[:-2]})'
 
     def __repr__(self):
         ret = ''
-        for k, v in vars(self).items():
+        for k, v in self.to_dict().items():
             ret += f'{k}={v}, '
         return f'PaceContainerPastPerformance({ret[:-2]})'
 
+    def to_dict(self) -> dict:
+        '''
+        What vars() gave before the class was slotted.
+        '''
+        return {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}
+
     def is_winner(self) -> bool:
         return self.winner == 1
 
+    def _get_speed_figure(self, track_code: str, par_index: ParIndex) -> float | None:
+        '''
+        The horse's own final time (the leader's plus its beaten lengths, worked out the same way as
+        utility.get_time_of_beaten_length) against the track's (track, distance, surface) par.
+        '''
+        if not track_code or self.course is None or not self.t3:
+            return None
+        time_of_beaten_length = round(1.0 / (self.distance * 660 / self.t3 / 10.0), 2)
+        final_time = round(time_of_beaten_length * self.bl3 + self.t3, 2)
+        return get_speed_figure(final_time, par_index.get_par(track_code, self.distance, self.course.name))
+
+
+def _average(index: int) -> property:
+    return property(lambda self: self.get_average(index))
+
 
 class PaceContainer:
-    def __init__(self, sfh: SingleFileHorse):
+    '''
+    Averages a horse's pace figures over its past performances.
+
+    The averages are kept as running (optionally recency-weighted) sums, so add() and remove() update them in
+    O(1) instead of recomputing over every PP. Keeping past_performances in order (inserting at the front,
+    finding the PP to remove) is still linear in the number of PPs, a handful per horse. With window set only
+    the newest window PPs count, with decay set each PP counts decay times as much as the one added after it.
+    PPs from before reference_date's year (today by default) are left out when building from a
+    SingleFileHorse.
+    '''
+    __slots__ = ('past_performances', 'reference_date', 'window', 'decay', '_sums', '_compensations',
+                 '_total_weight', '_weights', '_next_weight')
+
+    average_fr1 = _average(0)
+    average_fr2 = _average(1)
+    average_fr3 = _average(2)
+    average_ep = _average(3)
+    average_sp = _average(4)
+    average_ap = _average(5)
+    average_energy = _average(6)
+
+    def __init__(self, sfh: SingleFileHorse | None = None, reference_date: date | None = None,
+                 window: int | None = None, decay: float | None = None, par_index: ParIndex | None = None):
+        # Newest first, the same order as SingleFileHorse.past_performances
         self.past_performances: list[PaceContainerPastPerformance] = []
-        if sfh.past_performances:
-            for pp in sfh.past_performances:
-                if not pp.track_code or int(pp.date[:4]) < date.today().year:
-                    continue
-                self.past_performances.append(PaceContainerPastPerformance(pp))
-        if self.past_performances:
-            fr1s = [float(pp.f1) for pp in self.past_performances]
-            fr2s = [float(pp.f2) for pp in self.past_performances]
-            fr3s = [float(pp.f3) for pp in self.past_performances]
-            eps = [float(pp.ep) for pp in self.past_performances]
-            sps = [float(pp.sp) for pp in self.past_performances]
-            aps = [float(pp.ap) for pp in self.past_performances]
-            es = [float(pp.energy) for pp in self.past_performances]
-            self.average_fr1 = round(sum(fr1s) / len(fr1s), 2)
-            self.average_fr2 = round(sum(fr2s) / len(fr2s), 2)
-            self.average_fr3 = round(sum(fr3s) / len(fr3s), 2)
-            self.average_ep = round(sum(eps) / len(eps), 2)
-            self.average_sp = round(sum(sps) / len(sps), 2)
-            self.average_ap = round(sum(aps) / len(aps), 2)
-            self.average_energy = round(sum(es) / len(es), 2)
-        else:
-            self.average_fr1 = 0
-            self.average_fr2 = 0
-            self.average_fr3 = 0
-            self.average_ep = 0
-            self.average_sp = 0
-            self.average_ap = 0
-            self.average_energy = 0
+        self.reference_date = reference_date or date.today()
+        self.window = window
+        self.decay = decay
+        self._sums = [0.0] * len(AVERAGE_COLUMNS)
+        self._compensations = [0.0] * len(AVERAGE_COLUMNS)
+        self._total_weight = 0.0
+        self._weights: dict[int, float] = {}
+        self._next_weight = 1.0
+        if sfh is not None and sfh.past_performances:
+            pps = [PaceContainerPastPerformance(pp, par_index) for pp in sfh.past_performances
+                   if pp.track_code and int(pp.date[:4]) >= self.reference_date.year]
+            if window is not None:
+                pps = pps[:window]
+            # Summed newest first, the same order as before add() existed, so the averages come out the same
+            for age, pp in enumerate(pps):
+                weight = 1.0 if decay is None else decay ** (age + 1 - len(pps))
+                self._insert(len(self.past_performances), pp, weight)
+            if decay is not None:
+                self._next_weight = decay ** -len(pps)
 
     def __str__(self):
         ret = ''
-        for k, v in vars(self).items():
+        for k, v in self.to_dict().items():
             ret += f'{k}={v}, '
         return f'PaceContainer({ret[:-2]})'
 
     def __repr__(self):
         ret = ''
-        for k, v in vars(self).items():
+        for k, v in self.to_dict().items():
             ret += f'{k}={v}, '
         return f'PaceContainer({ret[:-2]})'
+
+    def to_dict(self) -> dict:
+        ret = {'past_performances': self.past_performances}
+        for k in AVERAGE_COLUMNS:
+            ret[k] = getattr(self, k)
+        return ret
+
+    def get_average(self, index: int) -> float:
+        if not self.past_performances:
+            return 0
+        total = self._sums[index]
+        if self._compensations[index] and isfinite(self._compensations[index]):
+            total += self._compensations[index]
+        return round(total / self._total_weight, 2)
+
+    def add(self, pp: PaceContainerPastPerformance) -> None:
+        '''
+        Adds pp as the newest past performance, dropping the oldest if that takes us past the window.
+        '''
+        if id(pp) in self._weights:
+            raise ValueError(f'{pp} has already been added')
+        if self.decay is not None:
+            # Newer PPs get bigger weights instead of older ones getting smaller, so nothing already added
+            # has to be touched. Rescale once in a while so the weights don't overflow.
+            if self._next_weight > 1e100:
+                self._rescale(1 / self._next_weight)
+            weight = self._next_weight
+            self._next_weight /= self.decay
+        else:
+            weight = 1.0
+        self._insert(0, pp, weight)
+        if self.window is not None and len(self.past_performances) > self.window:
+            self.remove(self.past_performances[-1])
+
+    def remove(self, pp: PaceContainerPastPerformance) -> None:
+        if id(pp) not in self._weights:
+            raise ValueError(f'{pp} is not in this PaceContainer')
+        weight = self._weights.pop(id(pp))
+        self.past_performances.remove(pp)
+        if not self.past_performances:
+            # Start clean rather than carry rounding error forward
+            self._sums = [0.0] * len(AVERAGE_COLUMNS)
+            self._compensations = [0.0] * len(AVERAGE_COLUMNS)
+            self._total_weight = 0.0
+            return
+        self._total_weight -= weight
+        for i, figure in enumerate(self._get_figures(pp)):
+            self._accumulate(i, -weight * figure)
+
+    def _insert(self, index: int, pp: PaceContainerPastPerformance, weight: float) -> None:
+        self.past_performances.insert(index, pp)
+        self._weights[id(pp)] = weight
+        self._total_weight += weight
+        for i, figure in enumerate(self._get_figures(pp)):
+            self._accumulate(i, weight * figure)
+
+    def _accumulate(self, index: int, value: float) -> None:
+        # Neumaier compensated summation, the same as sum() does for floats, so a container built from a
+        # SingleFileHorse averages exactly like the old sum(...) / len(...) did
+        total = self._sums[index]
+        new_total = total + value
+        if abs(total) >= abs(value):
+            self._compensations[index] += (total - new_total) + value
+        else:
+            self._compensations[index] += (value - new_total) + total
+        self._sums[index] = new_total
+
+    def _rescale(self, factor: float) -> None:
+        self._sums = [total * factor for total in self._sums]
+        self._compensations = [compensation * factor for compensation in self._compensations]
+        self._total_weight *= factor
+        self._next_weight *= factor
+        for key in self._weights:
+            self._weights[key] *= factor
+
+    @staticmethod
+    def _get_figures(pp: PaceContainerPastPerformance) -> tuple[float, ...]:
+        return (float(pp.f1), float(pp.f2), float(pp.f3), float(pp.ep), float(pp.sp), float(pp.ap),
+                float(pp.energy))
+
+
+#######################################################################
+# Vectorized (columnar) pace figures
+#######################################################################
+def round_array(values: NDArray[np.float64], ndigits: int) -> NDArray[np.float64]:
+    '''
+    np.round() scales by 10**ndigits before rounding, which can land on the other side of a tie than the
+    builtin round() does. Anything that is close enough to a tie to be ambiguous is re-rounded with the
+    builtin so that the columnar figures match PaceContainerPastPerformance exactly.
+    '''
+    rounded = np.round(values, ndigits)
+    scaled = values * 10 ** ndigits
+    with np.errstate(invalid='ignore'):
+        ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(float(v), ndigits) for v in values[ties]]
+    return rounded
+
+
+def _as_float_array(values: ArrayLike) -> NDArray[np.float64]:
+    return np.asarray(values, dtype=np.float64)
+
+
+def compute_pace_figures(distance: ArrayLike, two_furlong_fraction: ArrayLike, four_furlong_fraction: ArrayLike,
+                         six_furlong_fraction: ArrayLike, final_time: ArrayLike, track_variant: ArrayLike,
+                         average_variant: ArrayLike, first_call_beaten_lengths: ArrayLike,
+                         second_call_beaten_lengths: ArrayLike,
+                         finish_beaten_lengths: ArrayLike) -> dict[str, NDArray[np.float64]]:
+    '''
+    Columnar version of the math in PaceContainerPastPerformance.__init__.
+
+    distance is the raw SingleFile distance (yards, negative for "about" distances). Missing fractions should
+    be passed as 0 or NaN; those rows get all-zero figures just like the scalar class. Rows the scalar class
+    would raise ZeroDivisionError on come back as inf/NaN instead.
+    '''
+    furlongs = round_array(np.abs(_as_float_array(distance)) / 220.0, 2)
+    two_f = _as_float_array(two_furlong_fraction)
+    four_f = _as_float_array(four_furlong_fraction)
+    six_f = _as_float_array(six_furlong_fraction)
+    t3 = _as_float_array(final_time)
+    track_variant = _as_float_array(track_variant)
+    average_variant = _as_float_array(average_variant)
+    bl1 = _as_float_array(first_call_beaten_lengths)
+    bl2 = _as_float_array(second_call_beaten_lengths)
+    bl3 = _as_float_array(finish_beaten_lengths)
+
+    sprint = furlongs < DEFAULT_MIN_ROUTE_DISTANCE
+    t1 = np.where(sprint, two_f, four_f)
+    t2 = np.where(sprint, four_f, six_f)
+
+    # Variant adjustments, see PaceContainerPastPerformance for the branch-by-branch version
+    variant_diff = average_variant - track_variant
+    adj3 = np.select(
+        [np.abs(variant_diff) <= 1, variant_diff > 4, track_variant > average_variant],
+        [0.0, variant_diff - 3, np.floor((variant_diff + 1) / 2)],
+        np.ceil((variant_diff - 1) / 2)
+    )
+    adj2 = np.where(adj3 > 0, np.floor(adj3 / 2), np.ceil(adj3 / 2))
+    adj1 = np.where(sprint,
+                    np.where(np.abs(adj3) > 3, np.round(adj2 / 2, 0), 0.0),
+                    np.round(2 * adj2 / 3, 0))
+
+    # Leader's times adjusted for DRF Track Variant
+    adj_t1 = t1 + 0.2 * adj1
+    adj_t2 = t2 + 0.2 * adj2
+    adj_t3 = t3 + 0.2 * adj3
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1 = round_array((np.where(sprint, 1320.0, 2640.0) - 10 * bl1) / adj_t1, 2)
+        f2 = round_array((1320 - 10 * (bl2 - bl1)) / (adj_t2 - adj_t1), 2)
+        f3 = round_array((660 * (furlongs - np.where(sprint, 4.0, 6.0)) - 10 * (bl3 - bl2)) / (adj_t3 - adj_t2), 2)
+        ep = round_array((np.where(sprint, 2640.0, 3960.0) - 10 * bl2) / adj_t2, 2)
+        sp = round_array((ep + f3) / 2, 2)
+        ap = np.where(sprint, round_array((f1 + f2 + f3) / 3, 2), round_array((f1 + f3) / 2, 2))
+        fx = round_array((f1 + f3) / 2, 2)
+        energy = round_array(ep / (ep + f3), 4)
+
+    empty = (t1 == 0) | np.isnan(t1)
+    figures = {'distance': furlongs, 't1': t1, 't2': t2, 't3': t3}
+    for name, values in zip(PACE_FIGURE_COLUMNS, [f1, f2, f3, ep, sp, ap, fx, energy]):
+        figures[name] = np.where(empty, 0.0, values)
+    return figures
+
+
+def get_courses(surface: ArrayLike, start_code: ArrayLike, all_weather_surface_flag: ArrayLike) -> NDArray[np.object_]:
+    from chart_parser import special_types
+
+    surface = np.asarray(surface, dtype=object)
+    start_code = np.asarray(start_code, dtype=object)
+    all_weather = np.asarray(all_weather_surface_flag, dtype=object) == 'A'
+    off_turf = np.array(['x' in code if code else False for code in start_code], dtype=bool)
+    courses = np.select(
+        [((surface == 'D') | ((surface == 'T') & off_turf)) & ~all_weather,
+         (surface == 'D') & all_weather,
+         surface == 'T',
+         surface == 'd',
+         surface == 't'],
+        [special_types.Course.DIRT, special_types.Course.ALL_WEATHER_TRACK, special_types.Course.TURF,
+         special_types.Course.INNER_TURF, special_types.Course.OUTER_TURF],
+        None
+    )
+    unknown_surfaces = surface[courses == None]  # noqa: E711
+    for unknown in set(unknown_surfaces):
+        logger.warning('Unknown surface: %r', unknown)
+    instrument.count('unknown_surfaces', len(unknown_surfaces))
+    return courses
+
+
+def get_average_variants(track_codes: ArrayLike, distances: ArrayLike, surfaces: ArrayLike,
+                         all_weather_surface_flags: ArrayLike) -> NDArray[np.int64]:
+    '''
+    Looks each distinct (track, distance, surface, all weather flag) up once instead of once per row.
+    '''
+    keys = list(zip(track_codes, distances, surfaces, all_weather_surface_flags))  # type: ignore
+    variants: dict[tuple, int] = {}
+    for key in set(keys):
+        track_code, distance, surface, all_weather_surface_flag = key
+        if track_code:
+            variants[key] = get_average_variant(track_code, distance, surface, all_weather_surface_flag)
+        else:
+            variants[key] = 0
+    return np.array([variants[key] for key in keys], dtype=np.int64)
+
+
+def pace_figures_from_dataframe(sfpp_df: DataFrame) -> DataFrame:
+    '''
+    Builds the same columns as PaceContainerPastPerformance(sfpp).to_dict() for every row of a DataFrame of
+    SingleFilePastPerformance attributes (see utility.singlefile_past_performance_to_dataframe). An existing
+    average_variant column is used as-is, otherwise the variants are looked up.
+    '''
+    from pandas import DataFrame
+
+    if 'average_variant' in sfpp_df.columns:
+        average_variant = sfpp_df['average_variant'].to_numpy()
+    else:
+        average_variant = get_average_variants(sfpp_df['track_code'], sfpp_df['distance'], sfpp_df['surface'],
+                                               sfpp_df['all_weather_surface_flag'])
+    figures = compute_pace_figures(
+        sfpp_df['distance'],
+        sfpp_df['two_furlong_fraction'],
+        sfpp_df['four_furlong_fraction'],
+        sfpp_df['six_furlong_fraction'],
+        sfpp_df['final_time'],
+        sfpp_df['track_variant'],
+        average_variant,
+        sfpp_df['first_call_beaten_lengths'],
+        sfpp_df['second_call_beaten_lengths'],
+        sfpp_df['finish_beaten_lengths']
+    )
+    columns = {
+        'distance': figures['distance'],
+        'course': get_courses(sfpp_df['surface'], sfpp_df['start_code'], sfpp_df['all_weather_surface_flag']),
+        't1': figures['t1'],
+        't2': figures['t2'],
+        't3': figures['t3'],
+        'track_variant': sfpp_df['track_variant'].to_numpy(),
+        'average_variant': average_variant,
+        'bl1': sfpp_df['first_call_beaten_lengths'].to_numpy(),
+        'bl2': sfpp_df['second_call_beaten_lengths'].to_numpy(),
+        'bl3': sfpp_df['finish_beaten_lengths'].to_numpy(),
+        'winner': (sfpp_df['finish_position'] == '1').to_numpy().astype(np.int64),
+    }
+    for name in PACE_FIGURE_COLUMNS:
+        columns[name] = figures[name]
+    return DataFrame(columns, index=sfpp_df.index)
+
+
+def average_pace_figures(pace_df: DataFrame, by: str | list[str]) -> DataFrame:
+    '''
+    PaceContainer's averages computed for every group in one pass, e.g. by=['name'] over the output of
+    pace_figures_from_dataframe(). Any PP filtering (missing track codes, old races) is up to the caller.
+
+    Each group is summed in row order with the same Neumaier compensation PaceContainer uses (the n-th row
+    of every group is added at once) and rounded like round(), so the averages match PaceContainer's
+    exactly when the rows are in SingleFileHorse.past_performances order. Rows with a missing (None/NaN) key
+    belong to no group and are left out, as groupby() leaves them out.
+    '''
+    from pandas import DataFrame
+
+    grouped = pace_df.groupby(by, sort=False)
+    # Those rows get an ngroup() of -1 or NaN, depending on the pandas version
+    groups = grouped.ngroup().to_numpy(dtype=np.float64)
+    keyed = groups >= 0
+    groups = groups[keyed].astype(np.int64)
+    figures = pace_df[['f1', 'f2', 'f3', 'ep', 'sp', 'ap', 'energy']].to_numpy(dtype=np.float64)[keyed]
+    positions = grouped.cumcount().to_numpy(dtype=np.float64)[keyed].astype(np.int64)
+    counts = np.bincount(groups, minlength=grouped.ngroups)
+    sums = np.zeros((len(counts), figures.shape[1]))
+    compensations = np.zeros_like(sums)
+    for position in range(counts.max(initial=0)):
+        rows = positions == position
+        group_rows = groups[rows]
+        totals = sums[group_rows]
+        values = figures[rows]
+        new_totals = totals + values
+        compensations[group_rows] += np.where(np.abs(totals) >= np.abs(values),
+                                              (totals - new_totals) + values, (values - new_totals) + totals)
+        sums[group_rows] = new_totals
+    with np.errstate(invalid='ignore'):
+        sums = np.where((compensations != 0) & np.isfinite(compensations), sums + compensations, sums)
+    averages = round_array(sums / counts[:, np.newaxis], 2)
+    return DataFrame(averages, index=grouped.size().index, columns=AVERAGE_COLUMNS)
@@ -0,0 +1,173 @@
+#! python3
+
+
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from pandas import DataFrame, Series
+
+
+PAR_INDEX_VERSION: int = 1
+PAR_FIGURE: float = 100.0
+
+
+ParKey = tuple[str, float, str, str, str]
+RollupKey = tuple[str, float, str]
+
+
+# Charts give "about" distances as negative numbers, PPs look pars up by the plain distance
+def get_par_key(track_code: str, distance: float, surface: str, race_class: str, track_condition: str) -> ParKey:
+    return (track_code.strip().upper(), round(abs(float(distance)), 2), surface, race_class or '',
+            track_condition or '')
+
+
+def get_rollup_key(track_code: str, distance: float, surface: str) -> RollupKey:
+    return (track_code.strip().upper(), round(abs(float(distance)), 2), surface)
+
+
+def _add_totals(index: dict, key: tuple, races: float, total_time: float) -> None:
+    totals = index.get(key)
+    if totals is None:
+        index[key] = [races, total_time]
+    else:
+        totals[0] += races
+        totals[1] += total_time
+
+
+def get_speed_figure(final_time: float, par: float | None) -> float | None:
+    '''
+    PAR_FIGURE for running the par time, proportionally more (less) for running faster (slower) than it.
+    '''
+    # A speed table's final_time is NaN when the chart had no final time or beaten lengths
+    if par is None or not final_time or not np.isfinite(final_time):
+        return None
+    return round(PAR_FIGURE * par / final_time, 2)
+
+
+class ParIndex:
+    '''
+    Par times (the average winning final time) for every (track, distance, surface, class, track condition)
+    seen in the speed tables, plus a coarser (track, distance, surface) rollup for when the class or the track
+    condition isn't known, e.g. for past performances.
+
+    Pars are kept as running totals, so add() folds in new speed tables without rescanning the old ones and
+    get_par() is a dictionary lookup. Races are remembered by (track, datekey) and only ever counted once;
+    races without a winning time are remembered too, so their days aren't picked up again.
+    '''
+    def __init__(self):
+        self.pars: dict[ParKey, list[float]] = {}
+        self.rollups: dict[RollupKey, list[float]] = {}
+        self.races: set[tuple[str, str]] = set()
+
+    def __len__(self) -> int:
+        return len(self.pars)
+
+    def __str__(self):
+        return f'ParIndex(pars={len(self.pars)}, rollups={len(self.rollups)}, races={len(self.races)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def add(self, track_code: str, speed_df: DataFrame) -> int:
+        '''
+        Folds a get_speed_table()/get_chart_speed_table() frame for track_code into the index. Returns the
+        number of races added; races that are already in the index are skipped.
+        '''
+        track_code = track_code.strip().upper()
+        if not len(speed_df):
+            return 0
+        races = {(track_code, str(datekey)) for datekey in speed_df['datekey'].unique()}
+        new_races = races - self.races
+        winners = speed_df[speed_df['winner'].astype(bool)]
+        added = 0
+        for datekey, race_class, distance, surface, track_condition, final_time in zip(
+                winners['datekey'], winners['class'], winners['distance'], winners['surface'],
+                winners['track_condition'], winners['final_time']):
+            race = (track_code, str(datekey))
+            # Dead heats give a race two winners, only the first is counted. A missing (NaN) time would make
+            # the par NaN for good.
+            if race not in new_races or not final_time or not np.isfinite(final_time):
+                continue
+            new_races.remove(race)
+            added += 1
+            _add_totals(self.pars, get_par_key(track_code, distance, surface, race_class, track_condition), 1,
+                        float(final_time))
+            _add_totals(self.rollups, get_rollup_key(track_code, distance, surface), 1, float(final_time))
+        self.races |= races
+        return added
+
+    def get_dates(self, track_code: str) -> set[str]:
+        '''
+        The YYYYmmdd dates with at least one race from track_code in the index.
+        '''
+        track_code = track_code.strip().upper()
+        return {datekey[:8] for race_track_code, datekey in self.races if race_track_code == track_code}
+
+    def get_par(self, track_code: str, distance: float, surface: str, race_class: str | None = None,
+                track_condition: str | None = None) -> float | None:
+        '''
+        The exact par if there is one, the (track, distance, surface) par if not, otherwise None.
+        '''
+        totals = None
+        if race_class is not None and track_condition is not None:
+            totals = self.pars.get(get_par_key(track_code, distance, surface, race_class, track_condition))
+        if totals is None:
+            totals = self.rollups.get(get_rollup_key(track_code, distance, surface))
+        if totals is None:
+            return None
+        return round(totals[1] / totals[0], 2)
+
+    def get_speed_figures(self, track_code: str, speed_df: DataFrame) -> Series:
+        '''
+        get_speed_figure() for every row of a speed table, NaN where there is no par.
+        '''
+        from pandas import Series
+
+        # Imported here, pacecontainer imports this module
+        from gallop.pacecontainer import round_array
+
+        pars = np.array([
+            np.nan if par is None else par
+            for par in (self.get_par(track_code, distance, surface, race_class, track_condition)
+                        for race_class, distance, surface, track_condition in zip(
+                            speed_df['class'], speed_df['distance'], speed_df['surface'],
+                            speed_df['track_condition']))
+        ], dtype=np.float64)
+        final_times = speed_df['final_time'].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Rounded like get_speed_figure's round(), so these match the PP speed figures
+            figures = round_array(PAR_FIGURE * pars / final_times, 2)
+        figures[final_times == 0] = np.nan
+        return Series(figures, index=speed_df.index, name='speed_figure')
+
+    def to_dict(self) -> dict:
+        return {
+            'version': PAR_INDEX_VERSION,
+            'pars': [[*key, *totals] for key, totals in self.pars.items()],
+            'rollups': [[*key, *totals] for key, totals in self.rollups.items()],
+            'races': sorted(self.races),
+        }
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> ParIndex:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != PAR_INDEX_VERSION:
+            raise ValueError(f'Unsupported par index version: {data.get("version")!r}')
+        index = cls()
+        index.pars = {tuple(row[:5]): row[5:] for row in data['pars']}  # type: ignore
+        index.rollups = {tuple(row[:3]): row[3:] for row in data['rollups']}  # type: ignore
+        index.races = {tuple(race) for race in data['races']}  # type: ignore
+        return index
@@ -0,0 +1,91 @@
+#! python3
+
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from pandas import DataFrame, Series
+
+
+_MISSING = object()
+
+
+def _get_kind(value: Any) -> str:
+    '''
+    The dtype kind pandas gives a one-row DataFrame holding this value.
+    '''
+    if value is _MISSING or isinstance(value, (float, np.floating)):
+        return 'f'
+    if isinstance(value, (bool, np.bool_)):
+        return 'b'
+    if isinstance(value, (int, np.integer)):
+        return 'i'
+    if isinstance(value, datetime):
+        return 'M'
+    return 'O'
+
+
+def _to_series(values: list[Any]) -> Series:
+    '''
+    Infers the dtype the same way concatenating one-row DataFrames would: a single kind keeps its dtype,
+    ints mixed with floats (or missing values) become float64 and anything else falls back to object.
+    '''
+    from pandas import Series
+
+    kinds = {_get_kind(value) for value in values}
+    if kinds == {'b'}:
+        return Series(np.array(values, dtype=bool))
+    if kinds == {'i'}:
+        return Series(np.array(values, dtype=np.int64))
+    if kinds <= {'i', 'f'}:
+        return Series(np.array([np.nan if value is _MISSING else value for value in values], dtype=np.float64))
+    if kinds == {'M'}:
+        return Series(values)
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = np.nan if value is _MISSING else value
+    return Series(array, dtype=object)
+
+
+class RecordBatch:
+    '''
+    Collects records column by column and builds one DataFrame at the end, instead of building a one-row
+    DataFrame per record and concatenating them. Column order, duplicate column names (matched up by
+    occurrence) and dtypes come out the same as concat(..., axis=0, ignore_index=True) would give.
+    '''
+    def __init__(self):
+        self._names: list[str] = []
+        self._columns: dict[tuple[str, int], list[Any]] = {}
+        self._rows = 0
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def append(self, record: Iterable[tuple[str, Any]]) -> None:
+        occurrences: dict[str, int] = {}
+        for name, value in record:
+            occurrence = occurrences.get(name, 0)
+            occurrences[name] = occurrence + 1
+            column = self._columns.get((name, occurrence))
+            if column is None:
+                column = [_MISSING] * self._rows
+                self._columns[(name, occurrence)] = column
+                self._names.append(name)
+            column.append(value)
+        self._rows += 1
+        if sum(occurrences.values()) != len(self._columns):
+            for column in self._columns.values():
+                if len(column) < self._rows:
+                    column.append(_MISSING)
+
+    def to_dataframe(self) -> DataFrame:
+        from pandas import DataFrame
+
+        df = DataFrame({i: _to_series(column) for i, column in enumerate(self._columns.values())})
+        return df.set_axis(self._names, axis=1)
@@ -1,62 +1,170 @@
 #! python3
 
 
-from fractions import Fraction
-from pandas import DataFrame, concat
+from __future__ import annotations
 
-# from chart_parser.chart import Chart
-from chart_parser.race import Race
+from collections.abc import Iterable
+import logging
+import os
+from typing import TYPE_CHECKING
 
-from gallop.utility import get_time_of_beaten_length, horse_to_dataframe
+import numpy as np
 
+from gallop import instrument
+from gallop.catalog import DataCatalog
+from gallop.odds import TakeoutTable, add_odds_columns
+from gallop.pacecontainer import round_array
+from gallop.pars import ParIndex
+from gallop.records import RecordBatch
+from gallop.utility import DEFAULT_WORKERS, get_chart_date, get_chart_paths, get_times_of_beaten_length, ordered_map
 
-def get_speed_table(race: Race, date: str) -> DataFrame:
-    horse_dfs: list[DataFrame] = []
-    time_of_beaten_length = get_time_of_beaten_length(race.distance, race.final)
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+    from chart_parser.chart import Chart
+    from chart_parser.race import Race
+
+
+logger = logging.getLogger(__name__)
+
+
+SPEED_TABLE_COLUMNS: list[str] = ['datekey', 'class', 'sex_restriction', 'age_restriction', 'distance', 'surface',
+                                  'track_condition', 'final_time', 'finish', 'winner', 'post_position', 'odds']
+SPEED_FIGURE_COLUMN: str = 'speed_figure'
+
+
+def _add_race(batch: RecordBatch, times: list[tuple[float, float, float]], race: Race, date: str) -> None:
+    '''
+    Appends everything but final_time for each starter; the (distance, final, blf) needed for final_time goes
+    into times so it can be worked out for the whole table at once.
+    '''
     for horse in race.horses:
         if not horse:
             continue
-        if horse.odds and horse.odds < 100:
-            f = Fraction(horse.odds / 100.0)
-            print(horse.odds / 100, f.denominator / (f.denominator + f.numerator))
-        horse_df = horse_to_dataframe(horse)
-        horse_df.insert(0, 'datekey', f'{date}{race.number:02d}')
-        horse_df.insert(2, 'class', race.class_codes)
-        horse_df.insert(3, 'sex_restriction', race.sex_restriction)
-        horse_df.insert(4, 'age_restriction', race.age_restriction)
-        horse_df.insert(5, 'distance', race.distance)
-        horse_df.insert(6, 'surface', race.course_type.name)
-        horse_df.insert(7, 'track_condition', race.track_condition)
-        horse_df.insert(41, 'final_time', round(time_of_beaten_length * horse.blf + race.final, 2))
-        horse_df.insert(42, 'winner', horse.is_winner())
-        horse_df = horse_df[['datekey', 'class', 'sex_restriction', 'age_restriction', 'distance', 'surface',
-                             'track_condition', 'final_time', 'finish', 'winner']]
-        horse_dfs.append(horse_df)
-    return concat(horse_dfs, axis=0, ignore_index=True)
-
-
-# def get_speed_table(chart: Chart) -> DataFrame:
-#     if not chart.header:
-#         raise ValueError
-#     race_dfs: list[DataFrame] = []
-#     for race in chart.races:
-#         if not race or not race.horses:
-#             continue
-#         horse_dfs: list[DataFrame] = []
-#         time_of_beaten_length = get_time_of_beaten_length(race.distance, race.final)
-#         for horse in race.horses:
-#             if not horse:
-#                 continue
-#             horse_df = horse_to_dataframe(horse)
-#             horse_df.insert(0, 'datekey', f'{chart.header.race_date.strftime('%Y%m%d')}{race.number:02d}')
-#             horse_df.insert(2, 'class', race.class_codes)
-#             horse_df.insert(3, 'sex_restriction', race.sex_restriction)
-#             horse_df.insert(4, 'age_restriction', race.age_restriction)
-#             horse_df.insert(5, 'distance', race.distance)
-#             horse_df.insert(6, 'surface', race.course_type.name)
-#             horse_df.insert(7, 'track_condition', race.track_condition)
-#             horse_df.insert(41, 'final_time', round(time_of_beaten_length * horse.blf + race.final, 2))
-#             horse_df.insert(42, 'winner', horse.is_winner())
-#             horse_dfs.append(horse_df)
-#         race_dfs.append(concat(horse_dfs, axis=0, ignore_index=True))
-#     return concat(race_dfs, axis=0, ignore_index=True)
+        batch.append([
+            ('datekey', f'{date}{race.number:02d}'),
+            ('class', race.class_codes),
+            ('sex_restriction', race.sex_restriction),
+            ('age_restriction', race.age_restriction),
+            ('distance', race.distance),
+            ('surface', race.course_type.name),
+            ('track_condition', race.track_condition),
+            ('finish', horse.finish),
+            ('winner', horse.is_winner()),
+            ('post_position', horse.post_position),
+            ('odds', horse.odds),
+        ])
+        times.append((race.distance, race.final, horse.blf))
+
+
+def _build_speed_table(batch: RecordBatch, times: list[tuple[float, float, float]]) -> DataFrame:
+    from pandas import DataFrame
+
+    if not len(batch):
+        return DataFrame(columns=SPEED_TABLE_COLUMNS)
+    distance, final, blf = np.array(times, dtype=np.float64).T
+    final_time = round_array(get_times_of_beaten_length(distance, final) * blf + final, 2)
+    df = batch.to_dataframe()
+    df.insert(SPEED_TABLE_COLUMNS.index('final_time'), 'final_time', final_time)
+    return df
+
+
+def add_speed_figures(speed_df: DataFrame, par_index: ParIndex | None, track_code: str | None) -> DataFrame:
+    '''
+    Adds a speed_figure column from par_index's pars for track_code (NaN where there is no par). Does nothing
+    without a par_index.
+    '''
+    if par_index is None:
+        return speed_df
+    if not track_code:
+        raise ValueError('A track code is needed to look up pars')
+    speed_df[SPEED_FIGURE_COLUMN] = par_index.get_speed_figures(track_code, speed_df)
+    return speed_df
+
+
+def add_odds(speed_df: DataFrame, takeouts: TakeoutTable | None, track_code: str | None) -> DataFrame:
+    '''
+    Adds odds.ODDS_COLUMNS with each race (datekey) as a field and track_code's takeouts. Does nothing
+    without takeouts.
+    '''
+    if takeouts is None:
+        return speed_df
+    return add_odds_columns(speed_df, 'datekey', takeouts=takeouts, track_code=track_code)
+
+
+def get_speed_table(race: Race, date: str, par_index: ParIndex | None = None, track_code: str | None = None,
+                    takeouts: TakeoutTable | None = None) -> DataFrame:
+    batch = RecordBatch()
+    times: list[tuple[float, float, float]] = []
+    _add_race(batch, times, race, date)
+    speed_df = add_speed_figures(_build_speed_table(batch, times), par_index, track_code)
+    return add_odds(speed_df, takeouts, track_code)
+
+
+def get_chart_speed_table(chart: Chart, par_index: ParIndex | None = None, track_code: str | None = None,
+                          takeouts: TakeoutTable | None = None) -> DataFrame:
+    '''
+    The speed table for every race on the card as one frame.
+    '''
+    if not chart.header:
+        raise ValueError('Chart has no header')
+    date = chart.header.race_date.strftime('%Y%m%d')
+    batch = RecordBatch()
+    times: list[tuple[float, float, float]] = []
+    for race in chart.races:
+        if not race or not race.horses:
+            continue
+        _add_race(batch, times, race, date)
+    speed_df = add_speed_figures(_build_speed_table(batch, times), par_index, track_code)
+    return add_odds(speed_df, takeouts, track_code)
+
+
+def _load_chart_speed_table(chart: Chart | str) -> DataFrame | None:
+    if isinstance(chart, str):
+        from chart_parser.utils import parse_chart
+
+        with instrument.timer('parse_chart'):
+            chart = parse_chart(chart)
+        instrument.count('charts_parsed')
+    if not chart.header:
+        instrument.count('charts_skipped', reason='no_header')
+        return None
+    return get_chart_speed_table(chart)
+
+
+def get_season_speed_table(charts: Iterable[Chart | str], workers: int = DEFAULT_WORKERS,
+                           par_index: ParIndex | None = None, track_code: str | None = None,
+                           takeouts: TakeoutTable | None = None) -> DataFrame:
+    '''
+    get_chart_speed_table for many charts (or chart paths) in order. Charts without a header are skipped.
+    With workers > 1 the charts are parsed and tabulated in a process pool; pass paths rather than parsed
+    charts then, so only the small tables have to travel between processes.
+    '''
+    from pandas import DataFrame, concat
+
+    chart_dfs = [chart_df for chart_df in ordered_map(_load_chart_speed_table, charts, workers)
+                 if chart_df is not None and len(chart_df)]
+    if chart_dfs:
+        speed_df = concat(chart_dfs, axis=0, ignore_index=True)
+    else:
+        speed_df = DataFrame(columns=SPEED_TABLE_COLUMNS)
+    return add_odds(add_speed_figures(speed_df, par_index, track_code), takeouts, track_code)
+
+
+def get_track_speed_table(charts_path: str, track_code: str, workers: int = DEFAULT_WORKERS,
+                          catalog: DataCatalog | None = None, par_index: ParIndex | None = None,
+                          takeouts: TakeoutTable | None = None) -> DataFrame:
+    return get_season_speed_table(get_chart_paths(charts_path, track_code, catalog), workers, par_index,
+                                  track_code, takeouts)
+
+
+def update_par_index(par_index: ParIndex, charts_path: str, track_code: str, workers: int = DEFAULT_WORKERS,
+                     catalog: DataCatalog | None = None) -> int:
+    '''
+    Adds the track's charts from days that aren't in par_index yet, without parsing the rest. Returns the
+    number of races added.
+    '''
+    dates = par_index.get_dates(track_code)
+    chart_paths = [chart_path for chart_path in get_chart_paths(charts_path, track_code, catalog)
+                   if get_chart_date(os.path.basename(chart_path), track_code).strftime('%Y%m%d') not in dates]
+    return par_index.add(track_code, get_season_speed_table(chart_paths, workers))
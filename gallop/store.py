@@ -0,0 +1,133 @@
+#! python3
+
+
+from __future__ import annotations
+
+from datetime import date
+from enum import Enum
+import os
+from typing import TYPE_CHECKING, Any
+
+from gallop.cache import ParseCache
+from gallop.catalog import DataCatalog
+from gallop.utility import (DEFAULT_WORKERS, get_cached_enum_columns, get_day_path, get_writable_dataframe,
+                            write_dataframe, write_pace_data)
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+PACE_DATASET: str = 'pace'
+PP_DATASET: str = 'pp'
+KEY_COLUMN: str = 'key'
+
+
+Filter = tuple[str, str, object]
+
+
+def get_date_key(race_date: date, race_number: int = 0) -> int:
+    '''
+    The YYYYmmddNN key the pace data uses for a race.
+    '''
+    return int(f'{race_date.strftime('%Y%m%d')}{race_number:02}')
+
+
+class SeasonStore:
+    '''
+    Pace data and combined SingleFile (PP) data on disk as Parquet, partitioned like
+    root/<dataset>/track=<track code>/year=<YYYY>/.
+
+    query() opens a dataset lazily, with the files memory-mapped, and only reads the partitions and row groups
+    its filters can match and the columns asked for, so opening years of data costs next to nothing. Both
+    datasets carry the YYYYmmddNN race key, which the start and end dates are turned into. Columns are stored
+    as get_writable_dataframe leaves them: duplicate names get .1, .2, ... suffixes and Course members are
+    written by name (and turned back into members when read).
+    '''
+    def __init__(self, root: str):
+        self.root = root
+
+    def __str__(self):
+        return f'SeasonStore(root={self.root})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_dataset_path(self, dataset: str) -> str:
+        return os.path.join(self.root, dataset)
+
+    def write_pace_data(self, charts_path: str, track_code: str, chunk_days: int = 1,
+                        workers: int = DEFAULT_WORKERS, cache: ParseCache | None = None,
+                        catalog: DataCatalog | None = None, rank_options: dict[str, Any] | None = None) -> list[str]:
+        return write_pace_data(charts_path, track_code, self.get_dataset_path(PACE_DATASET), 'parquet',
+                               chunk_days, workers, cache, catalog, rank_options)
+
+    def write_pp_data(self, track_code: str, race_date: date, df: DataFrame) -> str:
+        '''
+        Writes one day's combined SingleFile frame (see singlefile_to_combined_dataframe), replacing any
+        earlier copy of that day. Returns the path written.
+        '''
+        df = get_writable_dataframe(df)
+        df.insert(0, KEY_COLUMN, [get_date_key(race_date, number) for number in df['todays_race_number']])
+        path = get_day_path(self.get_dataset_path(PP_DATASET), track_code, race_date)
+        write_dataframe(df, path)
+        return path
+
+    def _open(self, dataset: str):
+        import pyarrow
+        from pyarrow import dataset as ds
+        from pyarrow.fs import LocalFileSystem
+
+        partition_schema = pyarrow.schema([('track', pyarrow.string()), ('year', pyarrow.int32())])
+        partitioning = ds.partitioning(partition_schema, flavor='hive')
+        path = self.get_dataset_path(dataset)
+        filesystem = LocalFileSystem(use_mmap=True)
+        discovered = ds.dataset(path, format='parquet', partitioning=partitioning, filesystem=filesystem)
+        # Discovery takes the schema from the first file, but a DRF field that was blank all day is a null
+        # column in that day's file and strings in the next one's, so every file's schema is unified
+        schema = pyarrow.unify_schemas([fragment.physical_schema for fragment in discovered.get_fragments()] +
+                                       [partition_schema], promote_options='permissive')
+        return ds.dataset(path, schema=schema, format='parquet', partitioning=partitioning, filesystem=filesystem)
+
+    def query(self, dataset: str = PACE_DATASET, columns: list[str] | None = None,
+              filters: list[Filter] | None = None, tracks: list[str] | None = None,
+              years: list[int] | None = None, start: date | None = None, end: date | None = None) -> DataFrame:
+        '''
+        Reads the rows matching every filter, as (column, op, value) tuples like pandas.read_parquet takes
+        (op is one of ==, !=, <, <=, >, >=, in, not in), from the given tracks and years and between start
+        and end (inclusive). Only columns are read, all of them by default; track and year are columns too.
+        '''
+        from pandas import DataFrame
+        from pyarrow.parquet import filters_to_expression
+
+        if not os.path.isdir(self.get_dataset_path(dataset)):
+            return DataFrame(columns=columns)
+        filters = list(filters or [])
+        if tracks is not None:
+            filters.append(('track', 'in', list(tracks)))
+        if years is not None:
+            filters.append(('year', 'in', list(years)))
+        if start is not None:
+            filters.append(('year', '>=', start.year))
+            filters.append((KEY_COLUMN, '>=', get_date_key(start)))
+        if end is not None:
+            filters.append(('year', '<=', end.year))
+            filters.append((KEY_COLUMN, '<=', get_date_key(end, 99)))
+        # Enum columns are stored by name, so they are compared by name
+        enums = get_cached_enum_columns()
+        filters = [(name, op, _get_enum_names(value) if name in enums else value)
+                   for name, op, value in filters]
+        table = self._open(dataset).to_table(columns=columns,
+                                             filter=filters_to_expression(filters) if filters else None)
+        df = table.to_pandas()
+        for column, enum in enums.items():
+            if column in df.columns:
+                df[column] = df[column].map(lambda name: None if name is None else enum[name])
+        return df
+
+
+def _get_enum_names(value: object) -> object:
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_get_enum_names(v) for v in value]
+    return value
@@ -1,62 +1,152 @@
 #! python3
 
 
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import date, datetime
+from enum import Enum
+from functools import partial
+from inspect import signature
+import logging
 import os
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from gallop import instrument
+from gallop.cache import ParseCache
+from gallop.catalog import DataCatalog, get_pp_track_code
+from gallop.odds import WIN_POOL, TakeoutTable, add_odds_columns
+from gallop.pacecontainer import (DEFAULT_MIN_ROUTE_DISTANCE, PaceContainerPastPerformance, pace_figures_from_dataframe,
+                                  round_array)
+from gallop.records import RecordBatch
+
+# pandas, scipy, brispy and chart_parser take seconds between them to import, which every short script and
+# pool worker would pay up front, so each function imports what it uses
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
-from pandas import DataFrame, concat
-from scipy.stats import norm
+    from brispy.singlefile import SingleFile, SingleFileHorse, SingleFilePastPerformance, SingleFileRace, SingleFileRow
+    from chart_parser.chart import Chart
+    from chart_parser.horse import Horse
+    from chart_parser.race import Race
+    from chart_parser.special_types import Course
 
-from brispy.singlefile import SingleFile, SingleFileHorse, SingleFilePastPerformance, SingleFileRace, SingleFileRow
-from chart_parser.chart import Chart
-from chart_parser.horse import Horse
-from chart_parser.race import Race
-from chart_parser.special_types import Course
-from chart_parser.utils import parse_chart
-from gallop.pacecontainer import PaceContainerPastPerformance
+
+logger = logging.getLogger(__name__)
 
 
 DEFAULT_PP_DATA_DIR: str = 'C:\\Users\\mathe\\OneDrive\\Documents\\horses\\pp_data\\2025'
+DEFAULT_WORKERS: int = 1
+DEFAULT_PENDING_PER_WORKER: int = 2
+DEFAULT_MIN_FIELD_SIZE: int = 5
+RANKED_FIGURES: list[str] = ['f1', 'f2', 'f3', 'ep', 'sp', 'ap', 'fx']
 
 
 #######################################################################
 # regular ol' utils for us to use
 #######################################################################
+def get_cached_enum_columns() -> dict[str, type[Enum]]:
+    '''
+    Enum columns that the parse cache and the Parquet outputs store by name.
+    '''
+    from chart_parser import special_types
+    return {'course': special_types.Course}
+
+
 def get_time_of_beaten_length(distance: float, time: float) -> float:
     return round(1.0 / (distance * 660 / time / 10.0), 2)
 
 
-def summarize_post_positions(charts: list[Chart]) -> None:
-    chart_dfs: list[DataFrame] = []
-    for chart in charts:
-        for race in chart.races:
-            for horse in race.horses:
-                horse_df = horse_to_dataframe(horse)
-                if horse.is_winner():
-                    horse_df['winner'] = 1
-                else:
-                    horse_df['winner'] = 0
-                chart_dfs.append(horse_df)
-    track_df: DataFrame = concat(chart_dfs, axis=0, ignore_index=True)
-    track_df = track_df[track_df['odds'] != 0.0]
-    track_df['odds'] = track_df['odds'] / 100.0
-    track_df['fair_odds'] = track_df['odds'] * (1 - 0.2)    # 20% takeout?
-    track_df['public_expected_wins'] = 1 / (1 + track_df['fair_odds'])
-    track_df['public_variance'] = track_df['public_expected_wins'] * (1 - track_df['public_expected_wins'])
-    post_positions = set(track_df['post_position'].to_list())
-    for post_position in post_positions:
-        pp_df = track_df[track_df['post_position'] == post_position]
-        pp_winner_df = pp_df[pp_df['winner'] == 1]
-        expected_wins = sum(pp_df['public_expected_wins'])
-        variance = sum(pp_df['public_variance'])
-        actual_wins = sum(pp_winner_df['winner'])
-        print(
-            post_position,
-            round(expected_wins, 2),
-            actual_wins,
-            round(variance, 2),
-            round(float(norm.cdf(actual_wins, loc=expected_wins, scale=variance)), 2)
-        )
+def get_times_of_beaten_length(distances: np.ndarray, times: np.ndarray) -> np.ndarray:
+    '''
+    get_time_of_beaten_length over whole columns, rounded the same way.
+    '''
+    return round_array(1.0 / (distances * 660 / times / 10.0), 2)
+
+
+def ordered_map[T, R](function: Callable[[T], R], items: Iterable[T], workers: int = DEFAULT_WORKERS) -> Iterator[R]:
+    '''
+    Like map(), but with workers > 1 the calls are spread over a process pool. Results still come back in
+    the order of items, and only a few calls per worker are in flight at once so finished results don't
+    pile up in the parent. The workers' instrumentation is merged into the parent's.
+    '''
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future[tuple[R, instrument.Snapshot | None]]] = deque()
+        for item in items:
+            pending.append(executor.submit(instrument.run_in_worker, instrument.INSTRUMENTATION.enabled, function,
+                                           item))
+            if len(pending) >= workers * DEFAULT_PENDING_PER_WORKER:
+                yield instrument.get_worker_result(pending.popleft())
+        while pending:
+            yield instrument.get_worker_result(pending.popleft())
+
+
+def summarize_post_positions(charts: list[Chart] | dict[str, list[Chart]], by: list[str] | None = None,
+                             takeouts: TakeoutTable | None = None,
+                             probability: str = 'normalized_probability') -> DataFrame:
+    '''
+    Compares each post position's actual wins to the wins the public's odds expected, in one grouped pass.
+
+    Pass charts as {track code: charts} to be able to bucket by 'track' as well as 'surface', 'distance'
+    or 'track_condition'. Returns one row per bucket and post position with the number of starters,
+    expected_wins, actual_wins, the variance and standard deviation of the expected wins, the z_score and
+    p_value (the chance of actual_wins or fewer if the public were right).
+
+    A starter's expected wins is its probability column from odds.add_odds_columns: by default the
+    normalized_probability, the odds with each race's overround taken out, or takeout_probability to go by
+    takeouts' win takeout for each track instead. Starters without odds are left out.
+    '''
+    from pandas import DataFrame, to_numeric
+    from scipy.stats import norm
+
+    if not isinstance(charts, dict):
+        charts = {'': charts}
+    batch = RecordBatch()
+    race_id = 0
+    for track_code, track_charts in charts.items():
+        for chart in track_charts:
+            for race in chart.races:
+                race_id += 1
+                for horse in race.horses:
+                    if not horse:
+                        continue
+                    batch.append([
+                        ('race', race_id),
+                        ('track', track_code),
+                        ('surface', race.course_type.name),
+                        ('distance', race.distance),
+                        ('track_condition', race.track_condition),
+                        ('post_position', horse.post_position),
+                        ('odds', horse.odds),
+                        ('winner', 1 if horse.is_winner() else 0),
+                    ])
+    keys = [*(by or []), 'post_position']
+    track_df = batch.to_dataframe()
+    if track_df.empty:
+        return DataFrame(columns=[*keys, 'starters', 'expected_wins', 'actual_wins', 'variance', 'std',
+                                  'z_score', 'p_value'])
+    # Missing odds come through as None or NaN, which compare False here and are dropped with the zeros
+    track_df = track_df[to_numeric(track_df['odds'], errors='coerce') > 0]
+    track_df = add_odds_columns(track_df, 'race', takeouts=takeouts, track_column='track', pool=WIN_POOL)
+    expected_wins = track_df[probability]
+    track_df = track_df.assign(expected_wins=expected_wins, variance=expected_wins * (1 - expected_wins))
+    summary = track_df.groupby(keys, sort=True).agg(
+        starters=('winner', 'size'),
+        expected_wins=('expected_wins', 'sum'),
+        actual_wins=('winner', 'sum'),
+        variance=('variance', 'sum'),
+    ).reset_index()
+    summary['std'] = np.sqrt(summary['variance'])
+    summary['z_score'] = (summary['actual_wins'] - summary['expected_wins']) / summary['std']
+    summary['p_value'] = norm.cdf(summary['z_score'])
+    return summary
 
 
 #######################################################################
@@ -70,23 +160,40 @@ def get_chart_date(chart_path: str, track_code: str) -> date:
     return datetime.strptime(chart_date, '%Y%m%d').date()
 
 
-def get_charts(path: str, track_code: str) -> list[Chart]:
-    charts: list[Chart] = []
+def get_chart_paths(path: str, track_code: str, catalog: DataCatalog | None = None) -> list[str]:
+    '''
+    Chart files are named <track code>YYYYmmdd.chart, so sorting on the file name sorts them by date.
+    '''
+    if catalog is not None:
+        return catalog.get_chart_paths(track_code, path)
+    chart_paths: list[str] = []
     for dir in os.listdir(path):
         dir_path = os.path.join(path, dir)
         for chart in os.listdir(dir_path):
             if chart[:len(track_code)] == track_code and \
                     chart[len(track_code)].isdigit():
-                chart_path = os.path.join(dir_path, chart)
-                charts.append(parse_chart(chart_path))
-    return charts
+                chart_paths.append(os.path.join(dir_path, chart))
+    return sorted(chart_paths, key=lambda chart_path: (os.path.basename(chart_path), chart_path))
+
+
+def iter_charts(path: str, track_code: str, workers: int = DEFAULT_WORKERS,
+                catalog: DataCatalog | None = None) -> Iterator[Chart]:
+    from chart_parser.utils import parse_chart
+    return ordered_map(parse_chart, get_chart_paths(path, track_code, catalog), workers)
+
+
+def get_charts(path: str, track_code: str, workers: int = DEFAULT_WORKERS,
+               catalog: DataCatalog | None = None) -> list[Chart]:
+    return list(iter_charts(path, track_code, workers, catalog))
 
 
 def horse_to_dataframe(horse: Horse) -> DataFrame:
+    from pandas import DataFrame
     return DataFrame([dict(vars(horse).items())])
 
 
 def race_to_dataframe(race: Race, skip_horses: bool = False) -> DataFrame:
+    from pandas import DataFrame
     if skip_horses:
         filtered_dict = {k: v for k, v in vars(race).items() if v != 'horses'}
     else:
@@ -95,6 +202,7 @@ def race_to_dataframe(race: Race, skip_horses: bool = False) -> DataFrame:
 
 
 def chart_to_dataframe(chart: Chart, skip_races: bool) -> DataFrame:
+    from pandas import DataFrame
     if skip_races:
         filtered_dict = {k: v for k, v in vars(chart).items() if v != 'races'}
     else:
@@ -102,19 +210,21 @@ def chart_to_dataframe(chart: Chart, skip_races: bool) -> DataFrame:
     return DataFrame([filtered_dict])
 
 
-def check_if_pp_exists(track_code: str, race_date: date) -> bool:
-    if len(track_code) == 2:
-        track_code += 'X'
-    file_name = f'{track_code}{race_date.strftime('%m%d')}.drf'
+def check_if_pp_exists(track_code: str, race_date: date, catalog: DataCatalog | None = None) -> bool:
+    if catalog is not None:
+        return catalog.check_if_pp_exists(track_code, race_date)
+    file_name = f'{get_pp_track_code(track_code)}{race_date.strftime('%m%d')}.drf'
     if os.path.exists(os.path.join(DEFAULT_PP_DATA_DIR, file_name)):
         return True
     return False
 
 
-def get_pp_path(track_code: str, race_date: date) -> str:
-    if len(track_code) == 2:
-        track_code += 'X'
-    file_name = f'{track_code}{race_date.strftime('%m%d')}.drf'
+def get_pp_path(track_code: str, race_date: date, catalog: DataCatalog | None = None) -> str:
+    if catalog is not None:
+        pp_path = catalog.get_pp_path(track_code, race_date)
+        if pp_path is not None:
+            return pp_path
+    file_name = f'{get_pp_track_code(track_code)}{race_date.strftime('%m%d')}.drf'
     return os.path.join(DEFAULT_PP_DATA_DIR, file_name)
 
 
@@ -127,142 +237,401 @@ def is_maiden(race: SingleFileRace) -> bool:
     return False
 
 
-def remove_todays_scratches(single_file: SingleFile, todays_scratches: list[str] | None = None) -> list[SingleFileRow]:
+def get_scratch_set(scratches: Iterable[str]) -> frozenset[str]:
+    '''
+    Casefolded once up front so matching a horse is a single set lookup.
+    '''
+    return frozenset(scratch.casefold() for scratch in scratches)
+
+
+def remove_todays_scratches(single_file: SingleFile,
+                            todays_scratches: Iterable[str] | None = None) -> list[SingleFileRow]:
     if not todays_scratches:
         return single_file.rows
-    else:
-        todays_scratches = [scratch.casefold() for scratch in todays_scratches]
+    scratches = get_scratch_set(todays_scratches)
+    rows: list[SingleFileRow] = []
     for row in single_file.rows:
-        if row.horse.name.casefold() in todays_scratches:
-            print(f'Removing a scratch: {row.horse.name}')
-    return [row for row in single_file.rows if row.horse.name.casefold() not in todays_scratches]
+        if row.horse.name.casefold() in scratches:
+            logger.info('Removing a scratch: %s', row.horse.name)
+            instrument.count('scratches_removed')
+        else:
+            rows.append(row)
+    return rows
 
 
 def singlefile_past_performance_to_dataframe(sfpp: SingleFilePastPerformance) -> DataFrame:
+    from pandas import DataFrame
     return DataFrame([dict(vars(sfpp).items())])
 
 
 def singlefile_past_performance_to_pace_container_past_performance(sfpp: SingleFilePastPerformance) -> DataFrame:
-    return DataFrame([dict(vars(PaceContainerPastPerformance(sfpp)).items())])
+    from pandas import DataFrame
+    return DataFrame([PaceContainerPastPerformance(sfpp).to_dict()])
 
 
 def create_dataframe_from_singlefile(single_file: SingleFile, skip_maidens=False) -> list[DataFrame | None]:
     return []
 
 
-def get_combined_dataframe_from_singlefile_horse_past_performances(horse: SingleFileHorse) -> DataFrame | None:
-    pp_dfs: list[DataFrame | None] = []
+def add_singlefile_horse_past_performances(batch: RecordBatch, horse: SingleFileHorse,
+                                           todays_race_number: int | None = None) -> None:
+    '''
+    Appends one record per past performance with its SingleFilePastPerformance attributes. add_pace_figures
+    puts the PaceContainerPastPerformance columns on the end once the batch is built.
+    '''
     for pp in horse.past_performances:
         if not pp.date or pp.distance / 220 > 12 or int(pp.date[:4]) < 2025:
             continue
         if not horse.program_number:
             continue
-        pp_df = singlefile_past_performance_to_dataframe(pp)
-        pc_df = singlefile_past_performance_to_pace_container_past_performance(pp)
-        combined_df = concat([pp_df, pc_df], axis=1, ignore_index=False)
-        combined_df.insert(0, 'horseid', int(horse.program_number))
-        combined_df.insert(0, 'name', horse.name)
-        pp_dfs.append(combined_df)
-    if pp_dfs != []:
-        pp_df = concat(pp_dfs, axis=0, ignore_index=True)
-    else:
-        pp_df = None
-    return pp_df
+        record = [('name', horse.name), ('horseid', int(horse.program_number))]
+        if todays_race_number is not None:
+            record.insert(0, ('todays_race_number', todays_race_number))
+            record.append(('horseno', horse.program_number))
+        record.extend(vars(pp).items())
+        batch.append(record)
+
+
+def add_pace_figures(df: DataFrame) -> DataFrame:
+    '''
+    Puts the PaceContainerPastPerformance columns (see pace_figures_from_dataframe) on the end of a frame of
+    SingleFilePastPerformance records, working out every row's figures at once.
+    '''
+    from pandas import concat
+    return concat([df, pace_figures_from_dataframe(df)], axis=1)
+
+
+def get_combined_dataframe_from_singlefile_horse_past_performances(horse: SingleFileHorse) -> DataFrame | None:
+    batch = RecordBatch()
+    add_singlefile_horse_past_performances(batch, horse)
+    if len(batch):
+        return add_pace_figures(batch.to_dataframe())
+    return None
 
 
 def singlefile_to_combined_dataframe(sf: SingleFile) -> DataFrame | None:
-    current_race_number: int = 0
-    todays_dfs: list[DataFrame | None] = []
-    race_dfs: list[DataFrame | None] = []
-    race_df: DataFrame | None = None
+    # One batch for the whole file, with the PaceContainer columns added on the end in one go
+    batch = RecordBatch()
     for row in sf.rows:
         if is_maiden(row.race):
             continue
-        if current_race_number != row.race.number:
-            if race_dfs:
-                race_df = concat(race_dfs, axis=0, ignore_index=True)
-                race_df.insert(0, 'todays_race_number', current_race_number)
-                todays_dfs.append(race_df)
-            current_race_number = row.race.number
-            race_dfs: list[DataFrame | None] = []
         if row.horse:
-            horse_df = get_combined_dataframe_from_singlefile_horse_past_performances(row.horse)
-            if horse_df is None:
-                continue
-            horse_df.insert(2, "horseno", row.horse.program_number)
-            race_dfs.append(horse_df)
-    if race_dfs:
-        # We need to do all this here to get the final race of the list
-        race_df = concat(race_dfs, axis=0, ignore_index=True)
-        race_df.insert(0, 'todays_race_number', current_race_number)
-        todays_dfs.append(race_df)
-    if todays_dfs:
-        # Create the day's dataframe with the PaceContainer entries added on the end
-        day_df = concat(todays_dfs, axis=0, ignore_index=True)
-        return day_df
-    else:
+            add_singlefile_horse_past_performances(batch, row.horse, row.race.number)
+    instrument.count('past_performances', len(batch))
+    if len(batch):
+        return add_pace_figures(batch.to_dataframe())
+    return None
+
+
+def _parse_singlefile_dataframe(pp_path: str) -> DataFrame | None:
+    from brispy.singlefile import SingleFile
+    with instrument.timer('parse_drf'):
+        single_file = SingleFile.create(pp_path)
+    instrument.count('drf_files_parsed')
+    with instrument.timer('build_dataframe'):
+        return singlefile_to_combined_dataframe(single_file)
+
+
+def get_singlefile_dataframe(pp_path: str, cache: ParseCache | None = None) -> DataFrame | None:
+    if cache is None:
+        return _parse_singlefile_dataframe(pp_path)
+    return cache.get_or_create(
+        cache.get_key(pp_path, namespace='singlefile'),
+        lambda: _parse_singlefile_dataframe(pp_path),
+        get_cached_enum_columns()
+    )
+
+
+def get_race_table(chart: Chart) -> DataFrame:
+    '''
+    One row per non-maiden race on the chart with what get_day_pace_data needs to know about it.
+    '''
+    from pandas import Series
+
+    batch = RecordBatch()
+    distances: list[float] = []
+    seen: set[int] = set()
+    for race in chart.races:
+        if 'Md' in race.abbreviated_race_name or race.number in seen:
+            # Skip maidens, and a race number we've already got
+            instrument.count('races_skipped', reason='maiden' if 'Md' in race.abbreviated_race_name else 'duplicate')
+            continue
+        seen.add(race.number)
+        batch.append([
+            ('todays_race_number', race.number),
+            ('key', int(f'{chart.header.race_date.strftime('%Y%m%d')}{race.number:02}')),
+            ('winner_name', race.get_winner().name.upper()),
+            ('todays_surface', race.course_type.name),
+        ])
+        distances.append(abs(race.distance))
+    race_table = batch.to_dataframe()
+    # Kept as objects so the ranked rows end up with the dtype the surviving races' distances have
+    race_table['todays_distance'] = Series(distances, dtype=object)
+    return race_table
+
+
+def rank_pace_data(data_frame: DataFrame, race_table: DataFrame,
+                   max_distance: float | None = DEFAULT_MIN_ROUTE_DISTANCE, min_distance: float | None = None,
+                   surface: Course | None = None, min_field_size: int = DEFAULT_MIN_FIELD_SIZE) -> DataFrame | None:
+    '''
+    Joins the day's SingleFile data (see singlefile_to_combined_dataframe) to the races in race_table (see
+    get_race_table) and ranks every pace figure within each race, all races at once.
+
+    Only races with todays_distance in [min_distance, max_distance) (sprints by default) and, if given, on
+    surface are kept. Each horse is kept once per race, and races need at least min_field_size horses and the
+    winner among them.
+    '''
+    from pandas import Series, concat
+
+    races = race_table.set_index('todays_race_number')
+    race_mask = Series(True, index=races.index)
+    if max_distance is not None:
+        race_mask &= races['todays_distance'] < max_distance
+    if min_distance is not None:
+        race_mask &= races['todays_distance'] >= min_distance
+    if instrument.INSTRUMENTATION.enabled:
+        instrument.count('races_skipped', int((~race_mask).sum()), reason='distance')
+    if surface is not None:
+        surface_mask = races['todays_surface'] == surface.name
+        if instrument.INSTRUMENTATION.enabled:
+            instrument.count('races_skipped', int((race_mask & ~surface_mask).sum()), reason='surface')
+        race_mask &= surface_mask
+    races = races[race_mask]
+    race_order = Series(range(len(races)), index=races.index)
+
+    # Rows keep their order within a race, and races keep the chart's order
+    order = data_frame['todays_race_number'].map(race_order)
+    rows = order[order.notna()].sort_values(kind='stable').index
+    day_df = data_frame.loc[rows]
+    race_numbers = day_df['todays_race_number']
+    day_df.insert(0, 'todays_winner', (day_df['name'] == race_numbers.map(races['winner_name'])).astype(int))
+    day_df.insert(0, 'key', race_numbers.map(races['key']))
+    day_df['todays_surface'] = race_numbers.map(races['todays_surface'])
+    day_df['todays_distance'] = race_numbers.map(races['todays_distance'])
+    day_df = day_df.drop_duplicates(subset=['key', 'name'], keep='first')
+
+    by_race = day_df.groupby('key', sort=False)['todays_winner']
+    big_enough = by_race.transform('size') >= min_field_size
+    has_winner = by_race.transform('max') == 1
+    if instrument.INSTRUMENTATION.enabled:
+        keys = day_df['key']
+        instrument.count('races_skipped', len(races) - keys.nunique(), reason='no_entries')
+        instrument.count('races_skipped', keys[~big_enough].nunique(), reason='field_size')
+        instrument.count('races_skipped', keys[big_enough & ~has_winner].nunique(), reason='no_winner')
+    day_df = day_df[big_enough & has_winner]
+    if day_df.empty:
         return None
+    instrument.count('races_ranked', day_df['key'].nunique())
+    day_df = day_df.assign(todays_distance=day_df['todays_distance'].infer_objects())
+    ranks = day_df.groupby('key', sort=False)[RANKED_FIGURES].rank(method='average', ascending=False)
+    return concat([day_df, ranks.add_prefix('rank_')], axis=1).reset_index(drop=True)
 
 
-def get_all_pace_data(charts_path: str, track_code: str) -> DataFrame | None:
-    charts: list[Chart] = get_charts(charts_path, track_code)
-    charts_dfs: list[DataFrame] = []
-    charts_df: DataFrame | None = None
-    # Now that we have the charts, we need to look and see if we have the DRF (SingleFile) data file
-    # for that day
-    for chart in charts:
-        chart_dfs: list[DataFrame] = []
-        if chart.header:
-            if check_if_pp_exists(track_code, chart.header.race_date):
-                # Now that we have a chart that has a corresponding data file, we need to get the SingleFile
-                # instance of the data file and then get the combined dataframe.
-                data_frame = singlefile_to_combined_dataframe(
-                    SingleFile.create(
-                        get_pp_path(track_code, chart.header.race_date)
-                    )
-                )
-                count = 1
-                for race in chart.races:
-                    if 'Md' in race.abbreviated_race_name or data_frame is None:
-                        # Skip maidens
-                        continue
-                    else:
-                        # It's a race we care about, find the ponies involved
-                        winner_name = race.get_winner().name
-                        race_df = data_frame[data_frame['todays_race_number'] == race.number]
-                        if not race_df.empty:
-                            race_df.insert(0, 'todays_winner', race_df['name'] == winner_name.upper())
-                            race_df.insert(0, 'key',
-                                           int(f'{chart.header.race_date.strftime('%Y%m%d')}{race.number:02}'))
-                            count += 1
-                            race_df = race_df.copy(True)
-                            race_df['todays_winner'] = race_df['todays_winner'].astype(int)
-                            race_df['todays_surface'] = Course.DIRT.name
-                            race_df['todays_distance'] = abs(race.distance)
-                            # TODO: Filter out different surfaces and/or distances
-                            race_df = race_df[race_df['todays_distance'] < 8]  # Sprints only
-                            race_df = race_df.drop_duplicates(subset=['name'], keep='first')
-                            if race_df.shape[0] > 4 and 1 in race_df['todays_winner'].values:
-                                race_df['rank_f1'] = race_df['f1'].rank(method='average', ascending=False)
-                                race_df['rank_f2'] = race_df['f2'].rank(method='average', ascending=False)
-                                race_df['rank_f3'] = race_df['f3'].rank(method='average', ascending=False)
-                                race_df['rank_ep'] = race_df['ep'].rank(method='average', ascending=False)
-                                race_df['rank_sp'] = race_df['sp'].rank(method='average', ascending=False)
-                                race_df['rank_ap'] = race_df['ap'].rank(method='average', ascending=False)
-                                race_df['rank_fx'] = race_df['fx'].rank(method='average', ascending=False)
-                                if 1 in race_df['todays_winner']:
-                                    chart_dfs.append(race_df)
-        if chart_dfs:
-            chart_df = concat(chart_dfs, axis=0, ignore_index=True)
-            charts_dfs.append(chart_df)
+def get_rank_options_key(rank_options: dict[str, Any] | None = None) -> str:
+    '''
+    rank_pace_data's keyword arguments as a string for cache keys and fingerprints, with the defaults filled
+    in so leaving an option out keys the same as passing its default.
+    '''
+    options = {name: parameter.default for name, parameter in signature(rank_pace_data).parameters.items()
+               if parameter.default is not parameter.empty}
+    unknown = set(rank_options or {}) - set(options)
+    if unknown:
+        raise TypeError(f'Unknown rank options: {sorted(unknown)}')
+    options.update(rank_options or {})
+    return ','.join(f'{name}={value.name if isinstance(value, Enum) else value}' for name, value in options.items())
+
+
+def get_day_pace_data(chart: Chart, data_frame: DataFrame | None, **kwargs) -> DataFrame | None:
+    '''
+    Ranks the day's SingleFile data against the chart, see rank_pace_data for the keyword arguments.
+    '''
+    if not chart.header or data_frame is None:
+        return None
+    race_table = get_race_table(chart)
+    if race_table.empty:
+        return None
+    with instrument.timer('rank'):
+        return rank_pace_data(data_frame, race_table, **kwargs)
+
+
+def get_chart_pp_path(chart_path: str, track_code: str, catalog: DataCatalog | None = None) -> str | None:
+    '''
+    The DRF (SingleFile) file for the chart's day, None if there isn't one. The chart's file name has the date
+    in it, so the chart doesn't have to be parsed.
+    '''
+    race_date = get_chart_date(os.path.basename(chart_path), track_code)
+    if not check_if_pp_exists(track_code, race_date, catalog):
+        return None
+    return get_pp_path(track_code, race_date, catalog)
+
+
+def get_chart_pace_data(chart_path: str, pp_path: str | None, track_code: str, cache: ParseCache | None = None,
+                        rank_options: dict[str, Any] | None = None) -> DataFrame | None:
+    '''
+    Everything get_all_pace_data does for a single chart, parsing included, so it can run in a worker
+    process and only send the (small) result back. pp_path is the day's DRF file (see get_chart_pp_path),
+    None if there isn't one. rank_options are passed on to rank_pace_data.
+    '''
+    if pp_path is None:
+        instrument.count('charts_skipped', reason='no_drf')
+        return None
+    if cache is not None:
+        return cache.get_or_create(
+            cache.get_key(chart_path, pp_path,
+                          namespace=f'pace:{track_code}:{get_rank_options_key(rank_options)}'),
+            lambda: _get_chart_pace_data(chart_path, pp_path, cache, rank_options),
+            get_cached_enum_columns()
+        )
+    return _get_chart_pace_data(chart_path, pp_path, cache, rank_options)
+
+
+def _get_chart_pace_data(chart_path: str, pp_path: str, cache: ParseCache | None,
+                         rank_options: dict[str, Any] | None) -> DataFrame | None:
+    from chart_parser.utils import parse_chart
+
+    with instrument.timer('parse_chart'):
+        chart = parse_chart(chart_path)
+    instrument.count('charts_parsed')
+    if not chart.header:
+        instrument.count('charts_skipped', reason='no_header')
+        return None
+    # Now that we have a chart that has a corresponding data file, we need to get the SingleFile
+    # instance of the data file and then get the combined dataframe.
+    data_frame = get_singlefile_dataframe(pp_path, cache)
+    return get_day_pace_data(chart, data_frame, **(rank_options or {}))
+
+
+def _get_chart_paths_pace_data(paths: tuple[str, str | None], track_code: str, cache: ParseCache | None,
+                               rank_options: dict[str, Any] | None) -> DataFrame | None:
+    chart_path, pp_path = paths
+    return get_chart_pace_data(chart_path, pp_path, track_code, cache, rank_options)
+
+
+def iter_pace_data(charts_path: str, track_code: str, chunk_days: int = 1, workers: int = DEFAULT_WORKERS,
+                   cache: ParseCache | None = None, catalog: DataCatalog | None = None,
+                   rank_options: dict[str, Any] | None = None) -> Iterator[DataFrame]:
+    '''
+    Yields get_all_pace_data's output in date order, chunk_days days (that have data) at a time, so only one
+    chunk has to be held in memory. rank_options are passed on to rank_pace_data (sprints on any surface by
+    default).
+    '''
+    from pandas import concat
+
+    chunk_dfs: list[DataFrame] = []
+    # The DRF files are looked up here so the workers are only sent the two paths, not the whole catalog
+    chart_paths = [(chart_path, get_chart_pp_path(chart_path, track_code, catalog))
+                   for chart_path in get_chart_paths(charts_path, track_code, catalog)]
+    # Checked up front rather than in every worker
+    get_rank_options_key(rank_options)
+    chart_pace_data = partial(_get_chart_paths_pace_data, track_code=track_code, cache=cache,
+                              rank_options=rank_options)
+    for chart_df in ordered_map(chart_pace_data, chart_paths, workers):
+        if chart_df is None:
+            continue
+        chunk_dfs.append(chart_df)
+        if len(chunk_dfs) >= chunk_days:
+            yield concat(chunk_dfs, axis=0, ignore_index=True)
+            chunk_dfs = []
+    if chunk_dfs:
+        yield concat(chunk_dfs, axis=0, ignore_index=True)
+
+
+def get_all_pace_data(charts_path: str, track_code: str, workers: int = DEFAULT_WORKERS,
+                      cache: ParseCache | None = None, catalog: DataCatalog | None = None,
+                      rank_options: dict[str, Any] | None = None) -> DataFrame | None:
+    from pandas import concat
+
+    charts_dfs: list[DataFrame] = list(iter_pace_data(charts_path, track_code, workers=workers, cache=cache,
+                                                      catalog=catalog, rank_options=rank_options))
     if charts_dfs:
         charts_df = concat(charts_dfs, axis=0, ignore_index=True)
         return charts_df
     return None
 
 
+def get_writable_dataframe(df: DataFrame) -> DataFrame:
+    '''
+    Parquet wants unique column names and neither it nor CSV can hold Course members, so duplicate names get
+    the same .1, .2, ... suffixes read_csv would give them and enums are written by name.
+    '''
+    from chart_parser import special_types
+
+    columns: list[str] = []
+    seen: dict[str, int] = {}
+    for column in df.columns:
+        count = seen.get(column, 0)
+        seen[column] = count + 1
+        columns.append(f'{column}.{count}' if count else column)
+    df = df.set_axis(columns, axis=1)
+    for column in columns:
+        if df[column].dtype == object and any(isinstance(value, special_types.Course) for value in df[column]):
+            df[column] = df[column].map(
+                lambda course: course.name if isinstance(course, special_types.Course) else course)
+    return df
+
+
+def get_day_path(output_path: str, track_code: str, race_date: date, file_format: str = 'parquet') -> str:
+    '''
+    output_path/track=<track code>/year=<YYYY>/<track code>YYYYmmdd.<file format>, where a day's output lives.
+    '''
+    return os.path.join(output_path, f'track={track_code}', f'year={race_date.year}',
+                        f'{track_code}{race_date.strftime('%Y%m%d')}.{file_format}')
+
+
+def write_dataframe(df: DataFrame, path: str, file_format: str = 'parquet') -> None:
+    '''
+    Writes df to a temporary dot file next to path and renames it into place. Dataset readers skip dot files,
+    so nobody sees a half written file.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+    if file_format == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def write_pace_data(charts_path: str, track_code: str, output_path: str, file_format: str = 'parquet',
+                    chunk_days: int = 1, workers: int = DEFAULT_WORKERS, cache: ParseCache | None = None,
+                    catalog: DataCatalog | None = None, rank_options: dict[str, Any] | None = None) -> list[str]:
+    '''
+    Streams iter_pace_data into output_path/track=<track code>/year=<YYYY>/, one file per day (see
+    get_day_path), and returns the paths written. chunk_days is only how many days are held in memory at once.
+
+    Each day's file is replaced, and the file of a day that now has nothing (no DRF file, no race ranked) is
+    removed, so rerunning never leaves a day in twice.
+    '''
+    if file_format not in ('parquet', 'csv'):
+        raise ValueError(f'Unsupported file format: {file_format}')
+    paths: list[str] = []
+    for chunk_df in iter_pace_data(charts_path, track_code, chunk_days, workers, cache, catalog, rank_options):
+        chunk_df = get_writable_dataframe(chunk_df)
+        for day, day_df in chunk_df.groupby(chunk_df['key'] // 100, sort=True):
+            path = get_day_path(output_path, track_code, datetime.strptime(str(day), '%Y%m%d').date(),
+                                file_format)
+            write_dataframe(day_df, path, file_format)
+            paths.append(path)
+    written = set(paths)
+    for chart_path in get_chart_paths(charts_path, track_code, catalog):
+        path = get_day_path(output_path, track_code, get_chart_date(os.path.basename(chart_path), track_code),
+                            file_format)
+        if path not in written and os.path.exists(path):
+            os.remove(path)
+    return paths
+
+
 def filter_all_pace_data(dataframe: DataFrame) -> DataFrame:
-    ret = dataframe.copy()
-    ret = ret[ret['distance'] < 8]
-    ret = ret[ret['course'] == Course.DIRT]
-    return ret
+    '''
+    Dirt sprints. The combined frames have two distance columns, the SingleFile one in yards and then the
+    PaceContainer one in furlongs; the furlongs are the ones wanted here. Rows are picked with one mask, so
+    only the rows kept are copied. SeasonStore.query can do the same without loading the rest.
+    '''
+    from pandas import DataFrame
+
+    from chart_parser import special_types
+
+    distance = dataframe['distance']
+    if isinstance(distance, DataFrame):
+        distance = distance.iloc[:, -1]
+    return dataframe[(distance < DEFAULT_MIN_ROUTE_DISTANCE) & (dataframe['course'] == special_types.Course.DIRT)]
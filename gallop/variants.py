@@ -0,0 +1,131 @@
+#! python3
+
+
+from collections import OrderedDict
+from collections.abc import Callable
+import csv
+import logging
+
+from gallop import instrument
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_VARIANT_CACHE_SIZE: int = 4096
+DEFAULT_MISSING_VARIANT: int = 17
+VARIANT_TABLE_FIELDS: list[str] = ['track_code', 'distance', 'surface', 'all_weather_surface_flag', 'average_variant']
+
+
+VariantKey = tuple[str, int, str, str]
+
+
+def get_variant_key(track_code: str, distance: int, surface: str, all_weather_surface_flag: str) -> VariantKey:
+    return (track_code.strip().upper(), int(distance), surface, all_weather_surface_flag or '')
+
+
+class VariantCache:
+    '''
+    Sits in front of horsedb2.variants.get_average_variant.
+
+    Variants preloaded from a table file are kept for the life of the cache. Anything else that has to go
+    to the backend is held in a bounded LRU, including failures, so a key that fails is only queried (and
+    reported) once.
+    '''
+    def __init__(self, max_size: int = DEFAULT_VARIANT_CACHE_SIZE,
+                 backend: Callable[[str, int, str, str], int] | None = None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._backend = backend
+        self._table: dict[VariantKey, int] = {}
+        self._cache: OrderedDict[VariantKey, int | None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._table) + len(self._cache)
+
+    def __str__(self):
+        return f'VariantCache(preloaded={len(self._table)}, cached={len(self._cache)}, ' \
+               f'hits={self.hits}, misses={self.misses})'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def backend(self) -> Callable[[str, int, str, str], int]:
+        if self._backend is None:
+            from horsedb2.variants import get_average_variant
+            self._backend = get_average_variant
+        return self._backend
+
+    def preload(self, path: str) -> int:
+        '''
+        Loads a CSV table with a VARIANT_TABLE_FIELDS header. Returns the number of variants loaded.
+        '''
+        count = 0
+        with open(path, newline='') as table:
+            for row in csv.DictReader(table):
+                key = get_variant_key(row['track_code'], int(row['distance']), row['surface'],
+                                      row['all_weather_surface_flag'])
+                self._table[key] = int(row['average_variant'])
+                count += 1
+        return count
+
+    def save(self, path: str) -> None:
+        '''
+        Writes every known (preloaded or fetched) variant out in the format preload() reads.
+        '''
+        with open(path, 'w', newline='') as table:
+            writer = csv.writer(table)
+            writer.writerow(VARIANT_TABLE_FIELDS)
+            for variants in (self._table, self._cache):
+                for key, variant in variants.items():
+                    if variant is not None:
+                        writer.writerow([*key, variant])
+
+    def clear(self) -> None:
+        self._table.clear()
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, track_code: str, distance: int, surface: str, all_weather_surface_flag: str,
+            default: int = DEFAULT_MISSING_VARIANT) -> int:
+        key = get_variant_key(track_code, distance, surface, all_weather_surface_flag)
+        variant = self._table.get(key)
+        if variant is not None:
+            self.hits += 1
+            return variant
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            variant = self._cache[key]
+            if variant is None:
+                instrument.count('variant_fallbacks')
+                return default
+            return variant
+        self.misses += 1
+        try:
+            with instrument.timer('variant_lookup'):
+                variant = int(self.backend(track_code, distance, surface, all_weather_surface_flag))
+        except Exception as e:
+            logger.warning('Average variant lookup failed for %s, using %d: %r', key, default, e)
+            instrument.count('variant_lookup_failures')
+            instrument.count('variant_fallbacks')
+            variant = None
+        self._cache[key] = variant
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return default if variant is None else variant
+
+
+DEFAULT_VARIANT_CACHE: VariantCache = VariantCache()
+
+
+def get_average_variant(track_code: str, distance: int, surface: str, all_weather_surface_flag: str,
+                        default: int = DEFAULT_MISSING_VARIANT) -> int:
+    return DEFAULT_VARIANT_CACHE.get(track_code, distance, surface, all_weather_surface_flag, default)
+
+
+def preload_variants(path: str) -> int:
+    return DEFAULT_VARIANT_CACHE.preload(path)